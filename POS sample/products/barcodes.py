@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+from .models import Product
+
+# Codes accepted in one lookup
+MAX_CODES = 100
+
+
+def normalize_code(code):
+    return str(code).strip()
+
+
+class BarcodeMap:
+    """
+    In-process map of SKU/barcode to the product's to_json() payload.
+    The misses of a lookup are loaded in one query, unknown codes are
+    remembered too. The product and category signals drop the entries
+    they change, max_age bounds what another process may have changed.
+    """
+
+    def __init__(self, max_size=50000, max_age=60):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        # code: (payload or None, loaded at)
+        self._entries = OrderedDict()
+        # product ID: code, to find the entry of a product whose code changed
+        self._codes = {}
+        self._generation = 0
+
+    def lookup(self, codes):
+        """
+        Returns {code: payload} for the codes of existing products, the
+        unknown codes are left out
+        """
+        codes = {normalize_code(code) for code in codes} - {""}
+        found, misses = {}, []
+        now = time.monotonic()
+        with self._lock:
+            generation = self._generation
+            for code in codes:
+                entry = self._entries.get(code)
+                if entry is None or now - entry[1] > self.max_age:
+                    misses.append(code)
+                    continue
+                self._entries.move_to_end(code)
+                if entry[0] is not None:
+                    found[code] = entry[0]
+
+        if misses:
+            products = Product.objects.select_related('category').filter(sku__in=misses)
+            loaded = {product.sku: product for product in products}
+            with self._lock:
+                # A product changed meanwhile, don't keep what was read before
+                keep = generation == self._generation
+                for code in misses:
+                    product = loaded.get(code)
+                    payload = product.to_json() if product is not None else None
+                    if payload is not None:
+                        found[code] = payload
+                    if keep:
+                        self._store(code, product, payload, now)
+        return found
+
+    def _store(self, code, product, payload, now):
+        self._entries[code] = (payload, now)
+        self._entries.move_to_end(code)
+        if product is not None:
+            self._codes[product.pk] = code
+        while len(self._entries) > self.max_size:
+            old_code, (old_payload, _) = self._entries.popitem(last=False)
+            if old_payload is not None:
+                self._codes.pop(old_payload['id'], None)
+
+    def invalidate(self, pk, code=None):
+        """
+        Drops the entries of the product, under its old and its new code
+        """
+        with self._lock:
+            self._generation += 1
+            old_code = self._codes.pop(pk, None)
+            for stale in (old_code, code):
+                if stale is not None:
+                    self._entries.pop(normalize_code(stale), None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._codes.clear()
+
+
+barcodes = BarcodeMap()
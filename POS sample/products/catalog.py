@@ -0,0 +1,68 @@
+import gzip
+import json
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from .models import CatalogChange, Product
+
+# Columns of the rows sent to the terminals, the fields of Product.to_json
+# without the stock valuation amounts
+COLUMNS = ("id", "text", "name", "description", "status", "category",
+           "buying_price", "price", "date", "quantity", "total_product")
+VALUES = ("id", "name", "name", "description", "status", "category__name",
+          "buying_price", "price", "date")
+SNAPSHOT_CACHE_TIMEOUT = 60 * 60
+
+
+def catalog_rows(products):
+    # quantity and total_product are the cart defaults of to_json
+    return [list(row) + [1, 0] for row in products.values_list(*VALUES).order_by('id')]
+
+
+def snapshot():
+    """
+    Returns (version, gzipped JSON) of every active product, built once
+    per catalog version
+    """
+    version = CatalogChange.current_version()
+    key = "catalog:snapshot:" + str(version)
+    body = cache.get(key)
+    if body is None:
+        # Rows changed after reading the version come again in the next delta
+        data = {
+            "version": version,
+            "columns": COLUMNS,
+            "rows": catalog_rows(Product.objects.filter(status="ACTIVE")),
+        }
+        body = gzip.compress(json.dumps(data, cls=DjangoJSONEncoder).encode())
+        cache.set(key, body, SNAPSHOT_CACHE_TIMEOUT)
+    return version, body
+
+
+def changes_since(since):
+    """
+    Args:
+        since: The catalog version the terminal holds
+
+    Returns the new version, the rows to upsert and the IDs to drop
+    """
+    with transaction.atomic():
+        # Every change up to the version read is committed
+        version = CatalogChange.current_version()
+        latest = {}
+        changes = CatalogChange.objects.filter(
+            version__gt=since, version__lte=version).order_by('version', 'id')
+        for product_id, deleted in changes.values_list('product_id', 'deleted'):
+            latest[product_id] = deleted
+
+        kept = [product_id for product_id, deleted in latest.items() if not deleted]
+        rows = catalog_rows(Product.objects.filter(pk__in=kept, status="ACTIVE"))
+
+    # Deleted or no longer active products
+    removed = set(latest) - {row[0] for row in rows}
+    return {
+        "version": version,
+        "columns": COLUMNS,
+        "rows": rows,
+        "deleted": sorted(removed),
+    }
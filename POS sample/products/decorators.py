@@ -0,0 +1,25 @@
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+
+
+def async_login_required(view=None, login_url=None):
+    """
+    login_required for async views, redirects the anonymous users to the
+    login page with the same next argument
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            # Loading the user reads the session, keep it off the event loop
+            authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+            if authenticated:
+                return await view_func(request, *args, **kwargs)
+            return redirect_to_login(request.get_full_path(), login_url)
+
+        return wrapper
+
+    if view is not None:
+        return decorator(view)
+    return decorator
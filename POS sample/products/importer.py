@@ -0,0 +1,264 @@
+import csv
+import json
+from itertools import islice
+from django.db import transaction
+from django.db.models import F
+from .models import CatalogChange, Category, Product, ProfitRollup, StockMovement
+from .barcodes import barcodes
+
+BATCH_SIZE = 1000
+
+# Fields a row may set, with the function used to read them
+FIELDS = {
+    "name": str,
+    "description": str,
+    "status": str,
+    "category": str,
+    "buying_price": float,
+    "price": float,
+    "quantity": int,
+}
+REQUIRED_FOR_CREATE = ("name", "status", "category")
+STATUSES = {choice for choice, label in Product.STATUS_CHOICES}
+
+
+class ImportReport:
+    """
+    Outcome of an import, errors are (row number, message) pairs
+    """
+
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+    def to_json(self):
+        return {
+            "created": self.created,
+            "updated": self.updated,
+            "errors": [{"row": line, "error": message} for line, message in self.errors],
+        }
+
+
+def read_rows(file, file_format):
+    """
+    Args:
+        file: Text file with the rows
+        file_format: "csv" or "json" (a list of objects)
+
+    Returns an iterator over the rows as dicts
+    """
+    if file_format == "csv":
+        return csv.DictReader(file)
+    if file_format == "json":
+        return iter(json.load(file))
+    raise ValueError("Unknown format: " + str(file_format))
+
+
+def clean_row(row, key):
+    """
+    Returns the key and the typed fields of a row, raises ValueError
+    """
+    values = {}
+    for field, cast in FIELDS.items():
+        value = row.get(field)
+        if value is None or value == "":
+            continue
+        try:
+            values[field] = cast(value)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid " + field + ": " + str(value))
+
+    if "status" in values and values["status"] not in STATUSES:
+        raise ValueError("Invalid status: " + values["status"])
+    if values.get("quantity", 0) < 0:
+        raise ValueError("The quantity can't be negative")
+
+    if key == "id":
+        try:
+            return int(row.get("id")), values
+        except (TypeError, ValueError):
+            raise ValueError("Invalid id: " + str(row.get("id")))
+
+    if not values.get("name"):
+        raise ValueError("Missing name")
+    return values["name"], values
+
+
+def load_categories():
+    # The categories table is small, map it by ID and name once
+    categories = {}
+    for category in Category.objects.only('id', 'name'):
+        categories[str(category.id)] = category
+        categories.setdefault(category.name, category)
+    return categories
+
+
+def drop_duplicates(accepted, report):
+    """
+    Reports and drops the rows whose product would share its fingerprint
+    with another row or another product, in a single query
+    """
+    claimed = {}
+    kept = []
+    for line, product, old in accepted:
+        if product.fingerprint is None:
+            # A duplicate from before the fingerprints, left as it is
+            kept.append((line, product, old))
+            continue
+        if product.fingerprint in claimed:
+            report.error(line, "Same product as row " + str(claimed[product.fingerprint]))
+            continue
+        claimed[product.fingerprint] = line
+        kept.append((line, product, old))
+
+    owners = dict(Product.objects.filter(
+        fingerprint__in=list(claimed)).values_list('fingerprint', 'pk'))
+    unique = []
+    for line, product, old in kept:
+        owner = owners.get(product.fingerprint)
+        if owner is not None and owner != product.pk:
+            report.error(line, "Product already exists: " + product.name)
+            continue
+        unique.append((line, product, old))
+    return unique
+
+
+def import_batch(rows, key, categories, report):
+    """
+    Args:
+        rows: List of (row number, row dict)
+        key: "id" or "name", how the rows are matched with the products
+        categories: Categories mapped by ID and name
+        report: The ImportReport to fill
+    """
+    cleaned = {}
+    for line, row in rows:
+        try:
+            row_key, values = clean_row(row, key)
+            if "category" in values:
+                if values["category"] not in categories:
+                    raise ValueError("Unknown category: " + values["category"])
+                values["category"] = categories[values["category"]]
+        except ValueError as e:
+            report.error(line, str(e))
+            continue
+        # A later row for the same product wins
+        cleaned[row_key] = (line, values)
+
+    if not cleaned:
+        return
+
+    with transaction.atomic():
+        # Lock the existing products of the batch, then load them with
+        # their pending stock movements
+        lookup = {"pk__in" if key == "id" else "name__in": list(cleaned)}
+        locked = Product.objects.filter(**lookup).lock()
+        products = Product.objects.filter(pk__in=locked).order_by('pk').annotate(
+            pending=StockMovement.pending_sum())
+        if key == "id":
+            existing = products.in_bulk()
+        else:
+            existing = {}
+            duplicated = set()
+            for product in products:
+                if product.name in existing:
+                    duplicated.add(product.name)
+                existing[product.name] = product
+            for name in duplicated:
+                line, values = cleaned.pop(name)
+                report.error(line, "Several products are named " + name)
+                del existing[name]
+
+        # (line, product, rollup state before the import or None if created)
+        accepted = []
+        updated_fields = set()
+        # The quantity of an existing product is a stock count, the
+        # difference with the stock on hand is recorded as a movement
+        adjustments = {}
+        for row_key, (line, values) in cleaned.items():
+            product = existing.get(row_key)
+            if product is None:
+                if key == "id":
+                    report.error(line, "Product not found: " + str(row_key))
+                    continue
+                missing = [field for field in REQUIRED_FOR_CREATE if field not in values]
+                if missing:
+                    report.error(line, "Missing " + ", ".join(missing))
+                    continue
+                product = Product(**values)
+                product.fingerprint = product.identity()
+                accepted.append((line, product, None))
+                continue
+
+            old = product.rollup_state(product.pending)
+            if "quantity" in values:
+                values = dict(values)
+                count = values.pop("quantity")
+                adjustments[product.pk] = count - (product.quantity + product.pending)
+            for field, value in values.items():
+                setattr(product, field, value)
+            if product.identity_changed():
+                product.fingerprint = product.identity()
+                values = dict(values, fingerprint=product.fingerprint)
+            updated_fields.update(values)
+            accepted.append((line, product, old))
+
+        accepted = drop_duplicates(accepted, report)
+        to_create = [product for line, product, old in accepted if product.pk is None]
+        to_update = [product for line, product, old in accepted if product.pk is not None]
+        changes = [(old, product.rollup_state(product.pending + adjustments.get(product.pk, 0)))
+                   for line, product, old in accepted if product.pk is not None]
+        StockMovement.record({product.pk: adjustments[product.pk] for product in to_update
+                              if product.pk in adjustments}, "ADJUSTMENT")
+
+        Product.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+        if to_update and updated_fields:
+            Product.objects.bulk_update(to_update, sorted(updated_fields), batch_size=BATCH_SIZE)
+
+        # Recompute the derived amounts in SQL
+        touched = [product.pk for product in to_create + to_update]
+        Product.objects.filter(pk__in=touched).update(
+            total_amount=F('price') * F('quantity'),
+            profit_amount=(F('price') - F('buying_price')) * F('quantity'),
+        )
+        ProfitRollup.record_changes(
+            changes + [(None, product.rollup_state()) for product in to_create])
+        CatalogChange.record(touched)
+
+    # Bulk queries skip the signals, keep the barcodes current. The search
+    # index catches up through the catalog version.
+    for product in to_create + to_update:
+        barcodes.invalidate(product.pk, product.sku)
+
+    report.created += len(to_create)
+    report.updated += len(to_update)
+
+
+def import_rows(rows, key="id", batch_size=BATCH_SIZE):
+    """
+    Creates or updates products in batches, each batch in its own transaction.
+
+    Args:
+        rows: Iterable of dicts with an id or a name and the fields to set,
+              the quantity of an existing product is the counted stock
+        key: "id" updates products by ID, "name" updates products by name
+             and creates the ones that don't exist
+        batch_size: Number of rows validated and written together
+
+    Returns an ImportReport, rows are numbered from 1
+    """
+    if key not in ("id", "name"):
+        raise ValueError("Unknown key: " + str(key))
+
+    report = ImportReport()
+    categories = load_categories()
+    numbered = enumerate(rows, start=1)
+    while True:
+        batch = list(islice(numbered, batch_size))
+        if not batch:
+            return report
+        import_batch(batch, key, categories, report)
@@ -0,0 +1,185 @@
+import contextvars
+import logging
+import re
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from django.db import connections
+from django.template.base import Template
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of queries per view name, checked by QueryBudgetMixin
+VIEW_QUERY_BUDGETS = {
+    "products:products_list": 6,
+    "products:get_products": 4,
+    "products:products_lookup": 3,
+    "sales:sales_add": 20,
+    "sales:sales_details": 6,
+    "sales:sales_receipt_pdf": 6,
+}
+
+_current = contextvars.ContextVar("request_timings", default=None)
+_template_render = None
+
+
+class RequestTimings:
+    """
+    Query count and time spent per phase (db, template, pdf) of a request
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.durations = defaultdict(float)
+        self._depth = defaultdict(int)
+
+    @contextmanager
+    def span(self, name):
+        # Nested spans of the same name are only counted once
+        self._depth[name] += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth[name] -= 1
+            if not self._depth[name]:
+                self.durations[name] += (time.perf_counter() - start) * 1000
+
+    def server_timing(self):
+        metrics = []
+        for name, duration in sorted(self.durations.items()):
+            metric = name + ";dur=" + format(duration, ".1f")
+            if name == "db":
+                metric += ';desc="' + str(self.queries) + ' queries"'
+            metrics.append(metric)
+        return ", ".join(metrics)
+
+
+def current_timings():
+    return _current.get()
+
+
+@contextmanager
+def span(name):
+    """
+    Times a block under the given name in the current request, if any
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    with timings.span(name):
+        yield
+
+
+def instrument_templates():
+    """
+    Times every template render, patched once per process
+    """
+    global _template_render
+    if _template_render is not None:
+        return
+    _template_render = Template.render
+
+    def render(self, context):
+        with span("template"):
+            return _template_render(self, context)
+
+    Template.render = render
+
+
+class ServerTimingMiddleware:
+    """
+    Records the queries and timings of every request, sends them in the
+    Server-Timing header and keeps them in response.timings
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_templates()
+
+    def __call__(self, request):
+        timings = RequestTimings()
+
+        def count_query(execute, sql, params, many, context):
+            timings.queries += 1
+            with timings.span("db"):
+                return execute(sql, params, many, context)
+
+        token = _current.set(timings)
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(count_query))
+                with timings.span("total"):
+                    response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        response["Server-Timing"] = timings.server_timing()
+        response.timings = timings
+
+        match = getattr(request, "resolver_match", None)
+        if match is not None:
+            logger.debug("%s: %d queries, %s", match.view_name,
+                         timings.queries, timings.server_timing())
+        return response
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin failing when a view runs more queries than its budget.
+    Needs ServerTimingMiddleware in the MIDDLEWARE setting.
+    """
+    query_budgets = VIEW_QUERY_BUDGETS
+
+    def assertWithinQueryBudget(self, response, budget=None):
+        timings = getattr(response, "timings", None)
+        if timings is None:
+            self.fail("The response has no timings, is ServerTimingMiddleware installed?")
+
+        view_name = response.resolver_match.view_name
+        if budget is None:
+            budget = self.query_budgets.get(view_name)
+        if budget is None:
+            self.fail("No query budget declared for " + view_name)
+
+        self.assertLessEqual(
+            timings.queries, budget,
+            view_name + " ran " + str(timings.queries) +
+            " queries, its budget is " + str(budget))
+
+
+class QueryPlanMixin:
+    """
+    TestCase mixin failing when a query reads a whole table instead of
+    going through an index. Sequential scans are disabled on PostgreSQL
+    while explaining, so a "Seq Scan" left in the plan means no index fits.
+    """
+
+    def full_scans(self, queryset):
+        """
+        Returns the lines of the queryset's plan that scan a whole table
+        """
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+            try:
+                plan = queryset.explain()
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute("RESET enable_seqscan")
+            return [line for line in plan.splitlines() if "Seq Scan" in line]
+        if connection.vendor == "sqlite":
+            # SCAN without USING walks the table, SEARCH and SCAN ... USING INDEX don't
+            plan = queryset.explain()
+            return [line for line in plan.splitlines()
+                    if re.search(r"\bSCAN\b", line) and "USING" not in line]
+        self.skipTest("No plan check for " + connection.vendor)
+
+    def assertUsesIndexes(self, queryset):
+        scans = self.full_scans(queryset)
+        self.assertFalse(
+            scans, "Full table scan in the plan of " + str(queryset.query) +
+            ":\n" + "\n".join(scans))
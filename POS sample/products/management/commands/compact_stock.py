@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from products.models import StockMovement
+
+
+class Command(BaseCommand):
+    help = "Folds the pending stock movements into the products' quantity"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        folded = StockMovement.compact(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            "Stock movements compacted: " + str(folded)))
@@ -0,0 +1,32 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from products.importer import BATCH_SIZE, import_rows, read_rows
+
+
+class Command(BaseCommand):
+    help = "Creates or updates products in bulk from a CSV or JSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV file with a header row, or JSON list of objects")
+        parser.add_argument(
+            "--key", choices=["id", "name"], default="id",
+            help="id updates products by ID, name also creates the missing products")
+        parser.add_argument("--format", choices=["csv", "json"],
+                            help="Guessed from the file extension by default")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        file_format = options["format"] or os.path.splitext(options["path"])[1].lstrip(".").lower()
+        if file_format not in ("csv", "json"):
+            raise CommandError("Unknown format, use --format csv or --format json")
+
+        with open(options["path"], newline="") as file:
+            report = import_rows(read_rows(file, file_format), key=options["key"],
+                                 batch_size=options["batch_size"])
+
+        for line, message in report.errors:
+            self.stderr.write("Row " + str(line) + ": " + message)
+        self.stdout.write(self.style.SUCCESS(
+            "Products created: " + str(report.created) +
+            ", updated: " + str(report.updated) +
+            ", errors: " + str(len(report.errors))))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from products.models import CatalogChange
+
+
+class Command(BaseCommand):
+    help = "Deletes the catalog changes superseded by a newer change of the same product"
+
+    def handle(self, *args, **options):
+        deleted = CatalogChange.prune()
+        self.stdout.write(self.style.SUCCESS(
+            "Catalog changes pruned: " + str(deleted)))
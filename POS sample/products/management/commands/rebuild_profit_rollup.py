@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from products.models import ProfitRollup
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the per-day profit rollup from the Product table"
+
+    def handle(self, *args, **options):
+        days = ProfitRollup.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            "Profit rollup rebuilt: " + str(days) + " days"))
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.5 on 2026-10-18 10:00
+
+from django.db import migrations, models
+from django.db.models import F, FloatField, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollup(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProfitRollup = apps.get_model('products', 'ProfitRollup')
+
+    rows = Product.objects.annotate(day=TruncDate('date')).values('day').annotate(
+        total_quantity=Sum('quantity'),
+        total=Sum(F('price') * F('quantity'), output_field=FloatField()),
+        total_profit=Sum((F('price') - F('buying_price')) * F('quantity'), output_field=FloatField()),
+    ).order_by('day')
+    ProfitRollup.objects.bulk_create([
+        ProfitRollup(day=row['day'], quantity=row['total_quantity'] or 0,
+                     total_amount=row['total'] or 0, profit=row['total_profit'] or 0)
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0016_alter_product_quantity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfitRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('total_amount', models.FloatField(default=0)),
+                ('profit', models.FloatField(default=0)),
+            ],
+            options={
+                'db_table': 'ProfitRollup',
+            },
+        ),
+        migrations.RunPython(backfill_rollup, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.1.5 on 2026-10-18 11:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0018_product_product_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('reason', models.CharField(choices=[('SALE', 'Sale'), ('ADJUSTMENT', 'Adjustment')], default='SALE', max_length=20)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(db_column='product', on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='products.product')),
+            ],
+            options={
+                'db_table': 'StockMovements',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['product', 'id'], name='stockmovement_product_id_idx'),
+        ),
+    ]
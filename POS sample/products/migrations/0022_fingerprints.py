@@ -0,0 +1,64 @@
+# Generated by Django 4.1.5 on 2026-10-18 15:30
+
+import hashlib
+from django.db import migrations, models
+
+
+def fingerprint(*parts):
+    normalized = "|".join(" ".join(str(part).casefold().split()) for part in parts)
+    return hashlib.sha1(normalized.encode()).hexdigest()
+
+
+def fill(model, identity):
+    # The oldest row of a set of duplicates gets the fingerprint, the
+    # others keep NULL until they are renamed
+    seen = set()
+    batch = []
+    for row in model.objects.order_by('pk').iterator(chunk_size=2000):
+        value = identity(row)
+        if value in seen:
+            continue
+        seen.add(value)
+        row.fingerprint = value
+        batch.append(row)
+        if len(batch) == 2000:
+            model.objects.bulk_update(batch, ['fingerprint'])
+            batch = []
+    model.objects.bulk_update(batch, ['fingerprint'])
+
+
+def fill_fingerprints(apps, schema_editor):
+    fill(apps.get_model('products', 'Category'), lambda category: fingerprint(category.name))
+    fill(apps.get_model('products', 'Product'),
+         lambda product: fingerprint(product.name, product.category_id))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0021_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.RunPython(fill_fingerprints, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True, unique=True),
+        ),
+    ]
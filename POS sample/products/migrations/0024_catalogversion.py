@@ -0,0 +1,42 @@
+# Generated by Django 4.1.5 on 2026-10-19 09:00
+
+from django.db import migrations, models
+
+
+def backfill_versions(apps, schema_editor):
+    CatalogChange = apps.get_model('products', 'CatalogChange')
+    CatalogVersion = apps.get_model('products', 'CatalogVersion')
+    # The existing changes keep their ID as version, the terminals hold those
+    CatalogChange.objects.update(version=models.F('id'))
+    latest = CatalogChange.objects.aggregate(version=models.Max('id'))['version'] or 0
+    CatalogVersion.objects.create(pk=1, version=latest)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0023_product_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'CatalogVersion',
+            },
+        ),
+        migrations.AddField(
+            model_name='catalogchange',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_versions, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='catalogchange',
+            index=models.Index(fields=['version'], name='catalogchange_version_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.5 on 2026-10-20 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0024_catalogversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profitrollup',
+            name='shard',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='profitrollup',
+            name='day',
+            field=models.DateField(),
+        ),
+        migrations.AddConstraint(
+            model_name='profitrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'shard'), name='unique_profitrollup_shard'),
+        ),
+    ]
@@ -1,16 +1,68 @@
-from django.db import models
+import hashlib
+import random
+from django.db import models, transaction
 from django.forms import model_to_dict
 from django.utils import timezone
-from datetime import datetime
-from django.db.models import F, ExpressionWrapper, FloatField, IntegerField
+from datetime import datetime, timedelta
+from django.db.models import Case, F, OuterRef, Q, Subquery, Sum, Value, When, ExpressionWrapper, FloatField, IntegerField
+from django.db.models.functions import Coalesce, TruncDate
+from .upsert import add_to_rows
 
 
+def fingerprint(*parts):
+    """
+    Hash of the identity fields of a row, case and spacing don't count.
+    Stored in a unique column, a duplicate is one index probe away.
+    """
+    normalized = "|".join(" ".join(str(part).casefold().split()) for part in parts)
+    return hashlib.sha1(normalized.encode()).hexdigest()
 
-class Category(models.Model):
+
+class FingerprintMixin:
+    """
+    Keeps the unique fingerprint column of a model in sync with its
+    IDENTITY_FIELDS. The fingerprint is only assigned to new rows and to
+    rows whose identity changed, the duplicates left with NULL by the
+    migration keep it until they are renamed.
+    """
+    IDENTITY_FIELDS = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        attnames = {cls._meta.get_field(field).attname for field in cls.IDENTITY_FIELDS}
+        if not instance.get_deferred_fields() & attnames:
+            instance._loaded_identity = instance.identity()
+        return instance
+
+    def identity_changed(self):
+        return self._state.adding or getattr(self, '_loaded_identity', None) != self.identity()
+
+    def refresh_fingerprint(self, kwargs):
+        """
+        Sets the fingerprint before a save that changes the identity
+        """
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not set(self.IDENTITY_FIELDS) & set(update_fields):
+            return
+        if not self.identity_changed():
+            return
+        self.fingerprint = self.identity()
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'fingerprint'}
+
+    def save(self, *args, **kwargs):
+        self.refresh_fingerprint(kwargs)
+        super().save(*args, **kwargs)
+        self._loaded_identity = self.identity()
+
+
+class Category(FingerprintMixin, models.Model):
     STATUS_CHOICES = (  # new
         ("ACTIVE", "Active"),
         ("INACTIVE", "Inactive")
     )
+    IDENTITY_FIELDS = ('name',)
 
     name = models.CharField(max_length=256)
     description = models.TextField(max_length=256)
@@ -19,21 +71,54 @@ class Category(models.Model):
         max_length=100,
         verbose_name="Status of the category",
     )
+    # Hash of the normalized name, two categories can't share it
+    fingerprint = models.CharField(max_length=40, unique=True, null=True, blank=True, editable=False)
 
     class Meta:
         # Table's name
         db_table = "Category"
         verbose_name_plural = "Categories"
+        indexes = [
+            # The forms only offer the active categories
+            models.Index(fields=['status'], name='category_status_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.name
 
+    def identity(self):
+        return fingerprint(self.name)
+
+
+class ProductQuerySet(models.QuerySet):
 
-class Product(models.Model):
+    def with_stock(self):
+        """
+        Annotates the stock on hand, the quantity snapshot plus the
+        pending movements, as product.stock
+        """
+        return self.annotate(stock=F('quantity') + StockMovement.pending_sum())
+
+    def lock(self):
+        """
+        Locks the rows in ID order, must be called inside a transaction.
+        Read the stock in a later statement: on PostgreSQL a statement
+        that waited on the locks still reads the other tables as of its
+        start, it would miss the movements committed meanwhile.
+
+        Returns the IDs of the locked rows
+        """
+        return list(self.select_for_update().order_by('pk').values_list('pk', flat=True))
+
+
+class Product(FingerprintMixin, models.Model):
     STATUS_CHOICES = (  # new
         ("ACTIVE", "Active"),
         ("INACTIVE", "Inactive")
     )
+    IDENTITY_FIELDS = ('name', 'category')
+    # Fields the product's ProfitRollup contribution depends on
+    ROLLUP_FIELDS = ('date', 'price', 'buying_price', 'quantity')
     date = models.DateTimeField(default=timezone.now)
     name = models.CharField(max_length=256)
     description = models.TextField(max_length=256)
@@ -50,11 +135,25 @@ class Product(models.Model):
     quantity = models.IntegerField(default=0)
     total_amount = models.FloatField(default=0)
     profit_amount = models.FloatField(default=0)  # Add this field
+    # Barcode scanned at the till, see products.barcodes
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    # Hash of the normalized name and the category, two products can't share it
+    fingerprint = models.CharField(max_length=40, unique=True, null=True, blank=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
     
     
     class Meta:
         # Table's name
         db_table = "Product"
+        indexes = [
+            # Keyset pagination of the products list
+            models.Index(fields=['date', 'id'], name='product_date_id_idx'),
+            # Active products in ID order, the catalog sync
+            models.Index(fields=['status', 'id'], name='product_status_id_idx'),
+            # Lookups by exact name, the import by name
+            models.Index(fields=['name'], name='product_name_idx'),
+        ]
 
     def __str__(self) -> str:
         return self.name
@@ -63,11 +162,66 @@ class Product(models.Model):
     def profit(self):
         return (self.price - self.buying_price) * self.quantity
 
+    def rollup_values(self):
+        return tuple(getattr(self, field) for field in self.ROLLUP_FIELDS)
+
+    def rollup_state(self, pending=0, values=None):
+        """
+        Returns the product's contribution to the ProfitRollup as
+        (day, quantity, total_amount, profit), None if it can't be known.
+        The rollup counts the stock on hand, the quantity snapshot plus the
+        pending stock movements.
+
+        Args:
+            pending: Sum of the product's movements not compacted yet
+            values: The ROLLUP_FIELDS values to use instead of the instance's
+        """
+        values = values or self.rollup_values()
+        if any(v is None or hasattr(v, 'resolve_expression') for v in values):
+            return None
+        date, price, buying_price, quantity = values
+        on_hand = quantity + pending
+        return (ProfitRollup.day_of(date), on_hand,
+                price * on_hand,
+                (price - buying_price) * on_hand)
+
+    @classmethod
+    def stored_stock(cls, pk, lock=False):
+        """
+        Returns the stored ROLLUP_FIELDS values and the pending movements
+        of the product, None if it doesn't exist. With lock, the row is
+        locked first and read by a second query.
+        """
+        if lock:
+            cls.objects.filter(pk=pk).lock()
+        row = cls.objects.filter(pk=pk).annotate(pending=StockMovement.pending_sum()).values_list(
+            *cls.ROLLUP_FIELDS, 'pending').first()
+        if row is None:
+            return None
+        return row[:-1], row[-1]
+
+    def identity(self):
+        return fingerprint(self.name, self.category_id)
+
     def save(self, *args, **kwargs):
         self.total_amount = self.price * self.quantity
         #self.profit_display = self.price - self.buying_price
         self.profit_amount  = (self.price - self.buying_price) * self.quantity
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            previous, pending = None, 0
+            stored = None if self._state.adding else Product.stored_stock(self.pk, lock=True)
+            if stored is not None:
+                # The row is locked, no sale moves the stock meanwhile
+                values, pending = stored
+                previous = self.rollup_state(pending, values)
+            super().save(*args, **kwargs)
+            state = self.rollup_state(pending)
+            if state is None:
+                # Saved with F expressions, read back the stored values
+                self.refresh_from_db(
+                    fields=['date', 'price', 'buying_price', 'quantity', 'total_amount', 'profit_amount'])
+                state = self.rollup_state(pending)
+            ProfitRollup.record_change(previous, state)
 
     def to_json(self):
         item = model_to_dict(self)
@@ -78,13 +232,364 @@ class Product(models.Model):
         item['total_product'] = 0
         return item
 
-    def update_buying_prices(self, buying_prices):
-        # Update buying prices for existing products
-        for product, buying_price in zip(Product.objects.all(), buying_prices):
-            product.buying_price = buying_price
-            product.save()
+    @classmethod
+    def update_buying_prices(cls, buying_prices):
+        """
+        Args:
+            buying_prices: Dict of {product ID: buying price}
+
+        Returns the ImportReport of the update
+        """
+        from .importer import import_rows
+        rows = [{"id": pk, "buying_price": price} for pk, price in buying_prices.items()]
+        return import_rows(rows, key="id")
 
     
-    def deduct_quantity(self, quantity):
-        self.quantity = F('quantity') - quantity
-        self.save(update_fields=['quantity'])
\ No newline at end of file
+    def deduct_quantity(self, quantity, reason="SALE"):
+        from .stock import reserve
+        with transaction.atomic():
+            # At the price read under the lock
+            locked = reserve({self.pk: quantity}, reason)[self.pk]
+            ProfitRollup.record_sale({locked: quantity})
+
+    def set_stock(self, count, reason="ADJUSTMENT"):
+        """
+        Sets the stock on hand to a counted quantity. The difference is
+        recorded as a movement, the pending sales still count.
+
+        Returns the quantity of the movement
+        """
+        from .stock import lock_products
+        with transaction.atomic():
+            locked = lock_products([self.pk])[self.pk]
+            delta = count - locked.stock
+            if delta:
+                StockMovement.record({self.pk: delta}, reason)
+                # A negative sale adds to the rollup
+                ProfitRollup.record_sale({locked: -delta})
+        return delta
+
+    @property
+    def on_hand(self):
+        return StockMovement.on_hand([self.pk]).get(self.pk, 0)
+
+
+class ProfitRollup(models.Model):
+    """
+    Per-day sums of the products' quantity, amount and profit, keyed by
+    the product's date. Kept up to date by the product saves and the sales.
+    Each day is split into SHARDS rows and a write picks one at random, so
+    concurrent checkouts of products created the same day rarely wait on
+    each other's row. The summaries sum the shards.
+    """
+    # Rows each day is split into
+    SHARDS = 16
+
+    day = models.DateField()
+    shard = models.PositiveSmallIntegerField(default=0)
+    quantity = models.BigIntegerField(default=0)
+    total_amount = models.FloatField(default=0)
+    profit = models.FloatField(default=0)
+
+    class Meta:
+        # Table's name
+        db_table = "ProfitRollup"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'shard'], name='unique_profitrollup_shard'),
+        ]
+
+    def __str__(self) -> str:
+        return str(self.day) + " #" + str(self.shard) + " | Profit: " + str(self.profit)
+
+    @staticmethod
+    def day_of(value):
+        if timezone.is_aware(value):
+            return timezone.localdate(value)
+        return value.date()
+
+    @classmethod
+    def record(cls, deltas):
+        """
+        Args:
+            deltas: Dict of {day: (quantity, total_amount, profit)} to add
+        """
+        shard = random.randrange(cls.SHARDS)
+        add_to_rows(cls, ('day', 'shard'), {
+            (day, shard): {"quantity": quantity, "total_amount": total_amount, "profit": profit}
+            for day, (quantity, total_amount, profit) in deltas.items()
+        })
+
+    @classmethod
+    def record_change(cls, old, new):
+        """
+        Args:
+            old: The product's rollup_state before the change, None if new
+            new: The product's rollup_state after the change, None if deleted
+        """
+        cls.record_changes([(old, new)])
+
+    @classmethod
+    def record_changes(cls, changes):
+        """
+        Args:
+            changes: Iterable of (old, new) rollup_state pairs
+        """
+        deltas = {}
+        for old, new in changes:
+            for state, sign in ((old, -1), (new, 1)):
+                if state is None:
+                    continue
+                day, quantity, total_amount, profit = state
+                current = deltas.get(day, (0, 0, 0))
+                deltas[day] = (current[0] + sign * quantity,
+                               current[1] + sign * total_amount,
+                               current[2] + sign * profit)
+        cls.record({day: delta for day, delta in deltas.items() if any(delta)})
+
+    @classmethod
+    def record_sale(cls, sold):
+        """
+        Args:
+            sold: Dict of {product: quantity sold}
+        """
+        deltas = {}
+        for product, quantity in sold.items():
+            day = cls.day_of(product.date)
+            current = deltas.get(day, (0, 0, 0))
+            deltas[day] = (current[0] - quantity,
+                           current[1] - product.price * quantity,
+                           current[2] - (product.price - product.buying_price) * quantity)
+        cls.record(deltas)
+
+    @classmethod
+    def summary(cls, today=None):
+        """
+        Returns the daily, weekly, monthly and overall profit along with
+        the grand totals in a single query
+        """
+        return cls.objects.aggregate(**cls.summary_aggregates(today))
+
+    @classmethod
+    async def asummary(cls, today=None):
+        return await cls.objects.aaggregate(**cls.summary_aggregates(today))
+
+    @staticmethod
+    def summary_aggregates(today=None):
+        today = today or timezone.localdate()
+        start_of_week = today - timedelta(days=today.weekday())
+        end_of_week = start_of_week + timedelta(days=6)
+        start_of_month = today.replace(day=1)
+        end_of_month = (start_of_month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+        return {
+            "daily_profit": Sum('profit', filter=Q(day=today)),
+            "weekly_profit": Sum('profit', filter=Q(day__range=[start_of_week, end_of_week])),
+            "monthly_profit": Sum('profit', filter=Q(day__range=[start_of_month, end_of_month])),
+            "overall_profit": Sum('profit'),
+            "grand_product_total": Sum('quantity'),
+            "grand_total_amount": Sum('total_amount'),
+        }
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Recomputes the whole rollup from the Product table
+        """
+        rows = Product.objects.annotate(day=TruncDate('date')).values('day').annotate(
+            total_quantity=Sum('quantity'),
+            total=Sum(F('price') * F('quantity'), output_field=FloatField()),
+            total_profit=Sum((F('price') - F('buying_price')) * F('quantity'), output_field=FloatField()),
+        ).order_by('day')
+
+        with transaction.atomic():
+            # Fold the pending stock movements into the products first
+            StockMovement.compact()
+            cls.objects.all().delete()
+            return len(cls.objects.bulk_create([
+                cls(day=row['day'], quantity=row['total_quantity'] or 0,
+                    total_amount=row['total'] or 0, profit=row['total_profit'] or 0)
+                for row in rows
+            ], batch_size=1000))
+
+
+class StockMovement(models.Model):
+    """
+    Append-only ledger of the stock changes. The on-hand quantity of a
+    product is its quantity, the snapshot of the last compaction, plus the
+    movements recorded since. Sales append through products.stock.reserve,
+    which locks the products' rows in ID order to check the stock.
+    """
+    REASON_CHOICES = (
+        ("SALE", "Sale"),
+        ("ADJUSTMENT", "Adjustment"),
+    )
+
+    product = models.ForeignKey(
+        Product, related_name="movements", on_delete=models.CASCADE, db_column='product')
+    quantity = models.IntegerField()
+    reason = models.CharField(choices=REASON_CHOICES, max_length=20, default="SALE")
+    date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # Table's name
+        db_table = "StockMovements"
+        indexes = [
+            models.Index(fields=['product', 'id'], name='stockmovement_product_id_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return str(self.product_id) + " | " + str(self.quantity) + " | " + self.reason
+
+    @classmethod
+    def record(cls, deltas, reason="SALE"):
+        """
+        Args:
+            deltas: Dict of {product ID: quantity to add, negative to deduct}
+            reason: One of REASON_CHOICES
+        """
+        cls.objects.bulk_create([
+            cls(product_id=product_id, quantity=quantity, reason=reason)
+            for product_id, quantity in deltas.items() if quantity
+        ])
+
+    @classmethod
+    def pending_sum(cls):
+        """
+        Sum of the movements of the outer product not compacted yet, as an
+        expression to annotate a Product queryset with
+        """
+        pending = cls.objects.filter(product=OuterRef('pk')).order_by().values(
+            'product').annotate(total=Sum('quantity')).values('total')
+        return Coalesce(Subquery(pending), 0)
+
+    @classmethod
+    def on_hand(cls, product_ids):
+        """
+        Returns {product ID: current stock} in a single query
+        """
+        rows = Product.objects.filter(pk__in=product_ids).annotate(
+            pending=cls.pending_sum(),
+        ).values_list('pk', 'quantity', 'pending')
+        return {pk: quantity + pending for pk, quantity, pending in rows}
+
+    @classmethod
+    def compact(cls, batch_size=10000):
+        """
+        Folds the recorded movements into the products' quantity and
+        deletes them. The rollup already counts them, it isn't touched.
+
+        Returns the number of movements folded
+        """
+        folded = 0
+        while True:
+            with transaction.atomic():
+                movements = list(cls.objects.order_by('id').values_list(
+                    'id', 'product_id', 'quantity')[:batch_size])
+                if not movements:
+                    return folded
+
+                deltas = {}
+                for pk, product_id, quantity in movements:
+                    deltas[product_id] = deltas.get(product_id, 0) + quantity
+
+                # Same lock order as the stock reservations
+                list(Product.objects.select_for_update().filter(
+                    pk__in=deltas).order_by('pk').values_list('pk', flat=True))
+                delta = Case(
+                    *[When(pk=product_id, then=Value(quantity))
+                      for product_id, quantity in sorted(deltas.items())],
+                    default=Value(0), output_field=IntegerField(),
+                )
+                Product.objects.filter(pk__in=deltas).update(
+                    quantity=F('quantity') + delta,
+                    total_amount=F('price') * (F('quantity') + delta),
+                    profit_amount=(F('price') - F('buying_price')) * (F('quantity') + delta),
+                )
+                # Delete exactly the rows folded, newer ones stay pending
+                cls.objects.filter(id__in=[movement[0] for movement in movements]).delete()
+                folded += len(movements)
+
+
+
+class CatalogVersion(models.Model):
+    """
+    Single row holding the catalog's version. A change bumps it in its own
+    transaction and keeps the row locked until commit, so the versions
+    become visible in order: every change up to the version read is
+    committed.
+    """
+    version = models.BigIntegerField(default=0)
+
+    class Meta:
+        # Table's name
+        db_table = "CatalogVersion"
+
+    def __str__(self) -> str:
+        return "Catalog version " + str(self.version)
+
+    @classmethod
+    def bump(cls):
+        """
+        Returns the next version, must be called inside the writing
+        transaction, as late as possible: concurrent writers wait on it
+        """
+        if not cls.objects.filter(pk=1).update(version=F('version') + 1):
+            cls.objects.bulk_create([cls(pk=1)], ignore_conflicts=True)
+            cls.objects.filter(pk=1).update(version=F('version') + 1)
+        return cls.objects.values_list('version', flat=True).get(pk=1)
+
+    @classmethod
+    def current(cls):
+        return cls.objects.values_list('version', flat=True).filter(pk=1).first() or 0
+
+
+class CatalogChange(models.Model):
+    """
+    One row per product change, tagged with the catalog version of its
+    transaction. Terminals ask for the changes made after the version
+    they hold.
+    """
+    product_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    version = models.BigIntegerField(default=0)
+    date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # Table's name
+        db_table = "CatalogChanges"
+        indexes = [
+            models.Index(fields=['product_id', 'id'], name='catalogchange_product_idx'),
+            models.Index(fields=['version'], name='catalogchange_version_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return "Version " + str(self.version) + " | Product: " + str(self.product_id)
+
+    @classmethod
+    def record(cls, product_ids, deleted=False):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        with transaction.atomic():
+            version = CatalogVersion.bump()
+            cls.objects.bulk_create([
+                cls(product_id=pk, deleted=deleted, version=version) for pk in product_ids])
+
+    @classmethod
+    def current_version(cls):
+        return CatalogVersion.current()
+
+    @classmethod
+    def prune(cls):
+        """
+        Deletes the changes superseded by a newer change of the same
+        product, the deltas only need the latest one
+
+        Returns the number of changes deleted
+        """
+        newer = cls.objects.filter(
+            Q(version__gt=models.OuterRef('version')) |
+            Q(version=models.OuterRef('version'), id__gt=models.OuterRef('id')),
+            product_id=models.OuterRef('product_id'))
+        deleted, _ = cls.objects.filter(models.Exists(newer)).delete()
+        return deleted
@@ -0,0 +1,135 @@
+import base64
+from datetime import datetime
+from django.db.models import Q
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a cursor can't be decoded
+    """
+
+
+def encode_cursor(date, pk):
+    raw = date.isoformat() + "|" + str(pk)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        date, pk = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.fromisoformat(date), int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor("Invalid cursor: " + cursor) from e
+
+
+def page_size(request):
+    try:
+        size = int(request.GET.get('size', PAGE_SIZE))
+    except ValueError:
+        return PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+class KeysetPage:
+    """
+    A page of rows ordered by (date, id) descending, newest first
+    """
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def page_query(queryset, after=None, before=None, size=PAGE_SIZE):
+    """
+    Returns the queryset of the size + 1 rows to fetch for the page
+    """
+    if before:
+        date, pk = decode_cursor(before)
+        return queryset.filter(
+            Q(date__gt=date) | Q(date=date, id__gt=pk)).order_by('date', 'id')[:size + 1]
+
+    queryset = queryset.order_by('-date', '-id')
+    if after:
+        date, pk = decode_cursor(after)
+        queryset = queryset.filter(Q(date__lt=date) | Q(date=date, id__lt=pk))
+    return queryset[:size + 1]
+
+
+def build_page(rows, after=None, before=None, size=PAGE_SIZE):
+    """
+    Returns the KeysetPage of the rows fetched with page_query
+    """
+    more = len(rows) > size
+    if before:
+        items = rows[:size][::-1]
+        return KeysetPage(
+            items,
+            next_cursor=encode_cursor(items[-1].date, items[-1].id) if items else before,
+            previous_cursor=encode_cursor(items[0].date, items[0].id) if more else None,
+        )
+
+    items = rows[:size]
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(items[-1].date, items[-1].id) if more else None,
+        previous_cursor=encode_cursor(items[0].date, items[0].id) if after and items else None,
+    )
+
+
+def paginate(queryset, after=None, before=None, size=PAGE_SIZE):
+    """
+    Args:
+        queryset: The rows to paginate, must have date and id fields
+        after: Cursor of the last row of the previous page, for the next page
+        before: Cursor of the first row of the next page, for the previous page
+        size: Number of rows per page
+
+    Returns a KeysetPage, only size + 1 rows are fetched
+    """
+    rows = list(page_query(queryset, after, before, size))
+    return build_page(rows, after, before, size)
+
+
+async def apaginate(queryset, after=None, before=None, size=PAGE_SIZE):
+    rows = [row async for row in page_query(queryset, after, before, size)]
+    return build_page(rows, after, before, size)
+
+
+def paginate_request(request, queryset):
+    """
+    Paginates the queryset with the after, before and size GET arguments,
+    an invalid cursor falls back to the first page
+    """
+    size = page_size(request)
+    try:
+        return paginate(queryset, request.GET.get('after'), request.GET.get('before'), size)
+    except InvalidCursor:
+        return paginate(queryset, size=size)
+
+
+async def apaginate_request(request, queryset):
+    size = page_size(request)
+    try:
+        return await apaginate(queryset, request.GET.get('after'), request.GET.get('before'), size)
+    except InvalidCursor:
+        return await apaginate(queryset, size=size)
@@ -0,0 +1,184 @@
+import heapq
+import threading
+from collections import OrderedDict, defaultdict
+from asgiref.sync import sync_to_async
+from .models import CatalogChange, Product
+
+
+def normalize(text):
+    return " ".join(str(text).lower().split())
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def prefixes(text):
+    # Prefixes of one and two characters of every word, used by short terms
+    return {word[:size] for word in text.split() for size in (1, 2)}
+
+
+class ProductSearchIndex:
+    """
+    In-process n-gram index over the product names.
+    Terms of three characters or more match anywhere in the name through
+    the trigrams, shorter terms match the start of a word. Built on the
+    first search, every search then catches up with the catalog version
+    shared by all the processes, so the changes made by another worker
+    are seen by the next search.
+    """
+
+    def __init__(self, cache_size=1024):
+        self.cache_size = cache_size
+        self._lock = threading.RLock()
+        self._names = None
+        self._grams = defaultdict(set)
+        self._results = OrderedDict()
+        self._generation = 0
+        # Catalog version the names are current with
+        self._version = 0
+
+    @property
+    def built(self):
+        return self._names is not None
+
+    def build(self):
+        with self._lock:
+            # Read first, the changes made during the build come again in
+            # the next sync
+            self._version = CatalogChange.current_version()
+            self._names = {}
+            self._grams = defaultdict(set)
+            self._invalidate()
+            products = Product.objects.values_list('pk', 'name').iterator(chunk_size=5000)
+            for pk, name in products:
+                self._add(pk, name)
+
+    def sync(self):
+        """
+        Reloads the names of the products changed since the version the
+        index holds, one query when the catalog didn't change
+        """
+        version = CatalogChange.current_version()
+        with self._lock:
+            if not self.built:
+                self.build()
+                return
+            since = self._version
+        if version <= since:
+            return
+
+        changed = set(CatalogChange.objects.filter(
+            version__gt=since, version__lte=version).values_list('product_id', flat=True))
+        names = dict(Product.objects.filter(pk__in=changed).values_list('pk', 'name'))
+        with self._lock:
+            if self._version != since:
+                # Another thread synced meanwhile
+                return
+            for pk in changed:
+                self._remove(pk)
+                if pk in names:
+                    self._add(pk, names[pk])
+            self._version = version
+            # Also drops the results embedding a renamed category
+            self._invalidate()
+
+    def _keys(self, name):
+        return trigrams(name) | prefixes(name)
+
+    def _add(self, pk, name):
+        name = normalize(name)
+        self._names[pk] = name
+        for key in self._keys(name):
+            self._grams[key].add(pk)
+
+    def _remove(self, pk):
+        name = self._names.pop(pk, None)
+        if name is None:
+            return
+        for key in self._keys(name):
+            ids = self._grams.get(key)
+            if ids is not None:
+                ids.discard(pk)
+                if not ids:
+                    del self._grams[key]
+
+    def _invalidate(self):
+        self._results.clear()
+        self._generation += 1
+
+    def match(self, term, limit=10):
+        """
+        Returns the IDs of the first products whose name contains the term
+        """
+        term = normalize(term)
+        if not term:
+            return []
+
+        with self._lock:
+            if not self.built:
+                self.build()
+
+            if len(term) < 3:
+                candidates = self._grams.get(term, set())
+                return heapq.nsmallest(limit, candidates)
+
+            sets = sorted((self._grams.get(gram, set()) for gram in trigrams(term)), key=len)
+            candidates = set.intersection(*sets) if sets[0] else set()
+            # The trigrams may match out of order, confirm against the name
+            names = self._names
+            return heapq.nsmallest(limit, (pk for pk in candidates if term in names[pk]))
+
+    def cached(self, term, limit):
+        """
+        Returns (cached results or None, generation to cache new ones under)
+        """
+        key = (normalize(term), limit)
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key], self._generation
+            return None, self._generation
+
+    def remember(self, term, limit, generation, data):
+        with self._lock:
+            if generation != self._generation:
+                # The catalog changed meanwhile, don't cache stale results
+                return
+            self._results[(normalize(term), limit)] = data
+            if len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+
+    async def asearch(self, term, limit=10):
+        """
+        search() for async views, the products are loaded with the async ORM
+        """
+        await sync_to_async(self.sync)()
+        data, generation = self.cached(term, limit)
+        if data is not None:
+            return data
+
+        ids = self.match(term, limit)
+        products = {product.pk: product async for product in
+                    Product.objects.select_related('category').filter(pk__in=ids)}
+        data = [products[pk].to_json() for pk in ids if pk in products]
+        self.remember(term, limit, generation, data)
+        return data
+
+    def search(self, term, limit=10):
+        """
+        Returns the to_json() payload of the first products matching the term
+        """
+        self.sync()
+        data, generation = self.cached(term, limit)
+        if data is not None:
+            return data
+
+        ids = self.match(term, limit)
+        products = Product.objects.select_related('category').in_bulk(ids)
+        data = [products[pk].to_json() for pk in ids if pk in products]
+        self.remember(term, limit, generation, data)
+        return data
+
+
+index = ProductSearchIndex()
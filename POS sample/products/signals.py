@@ -0,0 +1,45 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from .barcodes import barcodes
+from .models import CatalogChange, Category, Product, ProfitRollup
+
+
+@receiver(pre_delete, sender=Product)
+def remove_from_rollup(sender, instance, **kwargs):
+    # Also covers the products deleted along with their category. Runs
+    # before the product's pending movements are deleted with it, the
+    # rollup counts them.
+    stored = Product.stored_stock(instance.pk)
+    if stored is not None:
+        values, pending = stored
+        ProfitRollup.record_change(instance.rollup_state(pending, values), None)
+
+
+@receiver(post_save, sender=Product)
+def bump_catalog_on_save(sender, instance, **kwargs):
+    CatalogChange.record([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def bump_catalog_on_delete(sender, instance, **kwargs):
+    CatalogChange.record([instance.pk], deleted=True)
+
+
+@receiver(post_save, sender=Category)
+def bump_catalog_on_category(sender, instance, created, **kwargs):
+    # The rows embed the category's name
+    if not created:
+        CatalogChange.record(
+            Product.objects.filter(category=instance).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_barcode(sender, instance, **kwargs):
+    barcodes.invalidate(instance.pk, instance.sku)
+
+
+@receiver(post_save, sender=Category)
+def clear_barcodes(sender, instance, **kwargs):
+    # The payloads embed the category's name
+    barcodes.clear()
@@ -0,0 +1,73 @@
+from django.db import transaction
+from .models import Product, StockMovement
+
+
+class InsufficientStock(Exception):
+    """
+    Raised when a reservation asks for more than is on hand, lines holds
+    the (product ID, requested, available) of every short product
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        super().__init__("Insufficient stock for products: " + ", ".join(
+            str(product_id) + " (" + str(requested) + " requested, " + str(available) + " available)"
+            for product_id, requested, available in lines))
+
+
+def lock_products(product_ids):
+    """
+    Locks the products' rows in ID order, so two carts sharing products
+    always wait on each other in the same order and never deadlock.
+    Must be called inside a transaction.
+
+    Returns {product ID: product} with the stock on hand as product.stock,
+    the rows are read once the locks are held
+    """
+    locked = Product.objects.filter(pk__in=product_ids).lock()
+    return Product.objects.with_stock().in_bulk(locked)
+
+
+def take(products, quantities, reason="SALE"):
+    """
+    Takes the quantities out of the stock of products locked by
+    lock_products, all of them or none. product.stock is left updated.
+
+    Args:
+        products: Dict of {product ID: locked product}
+        quantities: Dict of {product ID: quantity to take}
+        reason: Reason of the stock movements, one of StockMovement.REASON_CHOICES
+
+    Raises InsufficientStock listing every short product without
+    deducting anything, a missing product has no stock
+    """
+    available = {product_id: product.stock for product_id, product in products.items()}
+    short = [(product_id, quantity, available.get(product_id, 0))
+             for product_id, quantity in sorted(quantities.items())
+             if quantity > available.get(product_id, 0)]
+    if short:
+        raise InsufficientStock(short)
+
+    # The rows are locked, one insert deducts the whole cart
+    StockMovement.record(
+        {product_id: -quantity for product_id, quantity in quantities.items()}, reason)
+    for product_id, quantity in quantities.items():
+        products[product_id].stock -= quantity
+
+
+def reserve(quantities, reason="SALE"):
+    """
+    Locks the products and takes the quantities out of their stock, all
+    of them or none.
+
+    Args:
+        quantities: Dict of {product ID: quantity to take}
+        reason: Reason of the stock movements, one of StockMovement.REASON_CHOICES
+
+    Returns {product ID: locked product} with the stock left as
+    product.stock, raises InsufficientStock listing every short product
+    """
+    with transaction.atomic():
+        products = lock_products(list(quantities))
+        take(products, quantities, reason)
+    return products
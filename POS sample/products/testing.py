@@ -0,0 +1,29 @@
+from .models import Category, Product
+
+
+def create_category(name="Drinks", description="Cold drinks"):
+    return Category.objects.create(name=name, description=description, status="ACTIVE")
+
+
+def build_product(category, name="Soda", **fields):
+    """
+    Returns an unsaved active product, for bulk_create. The fields
+    override the defaults.
+    """
+    values = {"description": "Can", "status": "ACTIVE",
+              "buying_price": 1, "price": 2, "quantity": 10}
+    values.update(fields)
+    return Product(name=name, category=category, **values)
+
+
+def create_product(category, name="Soda", **fields):
+    product = build_product(category, name, **fields)
+    product.save()
+    return product
+
+
+def create_products(category, count, **fields):
+    """
+    Returns count products named "Soda 0", "Soda 1"...
+    """
+    return [create_product(category, "Soda " + str(i), **fields) for i in range(count)]
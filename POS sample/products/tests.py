@@ -1,3 +1,393 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth.models import User
+from django.db import DataError, IntegrityError
+from django.db.models import F
+from django.test import TestCase, modify_settings
+from django.urls import reverse
+from .barcodes import barcodes
+from .catalog import changes_since
+from .importer import import_rows
+from .instrumentation import QueryBudgetMixin, QueryPlanMixin
+from .models import CatalogChange, Category, Product, ProfitRollup, StockMovement
+from .pagination import encode_cursor, page_query
+from .search import ProductSearchIndex, index
+from .testing import create_category, create_product, create_products
 
-# Create your tests here.
+
+@modify_settings(MIDDLEWARE={'append': 'products.instrumentation.ServerTimingMiddleware'})
+class ProductsQueryBudgetTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('cashier', password='secret')
+        create_products(create_category(), 30)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        index.build()
+
+    def test_products_list(self):
+        response = self.client.get(reverse('products:products_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertWithinQueryBudget(response)
+
+    def test_get_products(self):
+        response = self.client.post(
+            reverse('products:get_products'), {'term': 'soda'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(len(response.json()), 10)
+        self.assertWithinQueryBudget(response)
+
+
+class ProductsQueryPlanTests(QueryPlanMixin, TestCase):
+    """
+    The hot queries of products.views must go through an index
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = Category.objects.bulk_create([
+            Category(name="Category " + str(i), description="Seeded",
+                     status="ACTIVE" if i % 4 else "INACTIVE")
+            for i in range(20)
+        ])
+        Product.objects.bulk_create([
+            Product(name="Product " + str(i), description="Seeded",
+                    status="ACTIVE" if i % 10 else "INACTIVE",
+                    category=categories[i % len(categories)],
+                    buying_price=1, price=2, quantity=10)
+            for i in range(2000)
+        ])
+
+    def test_products_list_page(self):
+        products = Product.objects.select_related('category')
+        self.assertUsesIndexes(page_query(products))
+        last = Product.objects.order_by('-date', '-id')[20]
+        self.assertUsesIndexes(page_query(products, after=encode_cursor(last.date, last.id)))
+
+    def test_active_products_in_id_order(self):
+        self.assertUsesIndexes(Product.objects.filter(status="ACTIVE").order_by('id'))
+
+    def test_active_categories(self):
+        self.assertUsesIndexes(Category.objects.filter(status="ACTIVE"))
+
+    def test_products_by_name(self):
+        self.assertUsesIndexes(Product.objects.filter(name__in=["Product 1", "Product 2"]))
+
+
+class FingerprintTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.drinks = create_category()
+        cls.snacks = create_category("Snacks", "Chips")
+        create_product(cls.drinks)
+
+    def test_duplicates_ignore_case_spacing_and_description(self):
+        with self.assertRaises(IntegrityError):
+            create_product(self.drinks, "  SODA ", description="Another can",
+                           status="INACTIVE", price=3, quantity=5)
+
+    def test_same_name_in_another_category(self):
+        create_product(self.snacks, description="Soda crackers")
+        self.assertEqual(Product.objects.filter(name="Soda").count(), 2)
+
+    def test_duplicate_category(self):
+        with self.assertRaises(IntegrityError):
+            Category.objects.create(name="drinks", description="Other", status="INACTIVE")
+
+    def test_legacy_duplicate_keeps_null_until_renamed(self):
+        legacy = create_product(self.drinks, "Cola")
+        Product.objects.filter(pk=legacy.pk).update(name="Soda", fingerprint=None)
+        legacy = Product.objects.get(pk=legacy.pk)
+        legacy.price = 3
+        legacy.save()
+        self.assertIsNone(Product.objects.get(pk=legacy.pk).fingerprint)
+        legacy.name = "Soda light"
+        legacy.save()
+        self.assertEqual(Product.objects.get(pk=legacy.pk).fingerprint, legacy.identity())
+
+    def test_import_reports_duplicates(self):
+        report = import_rows([
+            {"name": "soda", "status": "ACTIVE", "category": "Drinks"},
+            {"name": "Water", "status": "ACTIVE", "category": "Drinks"},
+            {"name": "water", "status": "ACTIVE", "category": "Drinks"},
+        ], key="name")
+        self.assertEqual(report.created, 1)
+        self.assertEqual(sorted(line for line, message in report.errors), [1, 3])
+
+
+class ImporterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = create_category()
+        cls.soda = create_product(cls.category)
+
+    def test_update_by_id(self):
+        report = import_rows([
+            {"id": str(self.soda.pk), "price": "3", "quantity": "8"},
+            {"id": "999999", "price": "1"},
+        ])
+        self.assertEqual((report.created, report.updated), (0, 1))
+        self.assertEqual(report.errors, [(2, "Product not found: 999999")])
+        soda = Product.objects.get(pk=self.soda.pk)
+        self.assertEqual((soda.price, soda.on_hand), (3, 8))
+        self.assertEqual(StockMovement.objects.filter(reason="ADJUSTMENT").get().quantity, -2)
+        self.assertEqual(ProfitRollup.summary()['grand_total_amount'], 24)
+
+    def test_update_by_name_creates_the_missing_products(self):
+        report = import_rows([
+            {"name": "Soda", "price": 4},
+            {"name": "Water", "status": "ACTIVE", "category": "Drinks", "price": 1, "quantity": 5},
+            {"name": "Juice", "price": 2},
+        ], key="name")
+        self.assertEqual((report.created, report.updated), (1, 1))
+        self.assertEqual(report.errors, [(3, "Missing status, category")])
+        self.assertEqual(Product.objects.get(pk=self.soda.pk).price, 4)
+        water = Product.objects.get(name="Water")
+        self.assertEqual((water.category, water.total_amount), (self.category, 5))
+
+    def test_bad_row_rolls_back_its_batch(self):
+        rows = [
+            {"name": "Water", "status": "ACTIVE", "category": "Drinks"},
+            {"name": "Juice", "status": "ACTIVE", "category": "Drinks"},
+            {"name": "Soda", "price": 5, "quantity": 4},
+            # Passes the checks but doesn't fit the quantity column
+            {"name": "Tea", "status": "ACTIVE", "category": "Drinks", "quantity": 10 ** 20},
+        ]
+        with self.assertRaises((DataError, OverflowError)):
+            import_rows(rows, key="name", batch_size=2)
+        self.assertEqual(sorted(Product.objects.values_list('name', flat=True)),
+                         ["Juice", "Soda", "Water"])
+        self.assertEqual(Product.objects.get(pk=self.soda.pk).price, 2)
+        self.assertFalse(StockMovement.objects.filter(reason="ADJUSTMENT").exists())
+
+
+class PaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('cashier', password='secret')
+        cls.products = create_products(create_category(), 5)
+        start = cls.products[0].date
+        # The first two pages meet between two products of the same date
+        for product, hours in zip(cls.products, [0, 1, 2, 2, 4]):
+            Product.objects.filter(pk=product.pk).update(date=start + timedelta(hours=hours))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def page(self, **cursor):
+        response = self.client.get(reverse('products:products_more'), dict(cursor, size=2))
+        return response.json()
+
+    def assertPage(self, page, positions):
+        self.assertEqual([product["id"] for product in page["products"]],
+                         [self.products[i].pk for i in positions])
+
+    def test_next_and_previous_across_the_page_boundaries(self):
+        first = self.page()
+        self.assertPage(first, [4, 3])
+        self.assertIsNone(first["previous_cursor"])
+
+        second = self.page(after=first["next_cursor"])
+        self.assertPage(second, [2, 1])
+        last = self.page(after=second["next_cursor"])
+        self.assertPage(last, [0])
+        self.assertIsNone(last["next_cursor"])
+
+        back = self.page(before=last["previous_cursor"])
+        self.assertPage(back, [2, 1])
+        self.assertEqual(back["next_cursor"], second["next_cursor"])
+        back = self.page(before=back["previous_cursor"])
+        self.assertPage(back, [4, 3])
+        self.assertIsNone(back["previous_cursor"])
+
+    def test_invalid_cursor_returns_the_first_page(self):
+        self.assertPage(self.page(after="not a cursor"), [4, 3])
+
+
+@modify_settings(MIDDLEWARE={'append': 'products.instrumentation.ServerTimingMiddleware'})
+class BarcodeLookupTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('cashier', password='secret')
+        category = create_category()
+        cls.soda = create_product(category, sku="7501055300075")
+        create_product(category, "Water", description="Bottle", sku="7501055300082")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        barcodes.clear()
+
+    def test_batch_lookup(self):
+        response = self.client.get(
+            reverse('products:products_lookup'), {'codes': '7501055300075,7501055300082,404'})
+        data = response.json()
+        self.assertEqual(data["products"]["7501055300075"]["text"], "Soda")
+        self.assertEqual(set(data["products"]), {"7501055300075", "7501055300082"})
+        self.assertEqual(data["missing"], ["404"])
+        self.assertWithinQueryBudget(response)
+
+    def test_repeated_scans_are_served_from_the_map(self):
+        barcodes.lookup(["7501055300075", "404"])
+        with self.assertNumQueries(0):
+            self.assertEqual(set(barcodes.lookup(["7501055300075", "404"])), {"7501055300075"})
+
+    def test_saving_a_product_invalidates_its_codes(self):
+        barcodes.lookup(["7501055300075"])
+        self.soda.sku = "7501055300099"
+        self.soda.price = 3
+        self.soda.save()
+        self.assertEqual(barcodes.lookup(["7501055300075"]), {})
+        self.assertEqual(barcodes.lookup(["7501055300099"])["7501055300099"]["price"], 3)
+
+
+class StockLedgerTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_product(create_category())
+
+    def assertRollup(self, quantity, total_amount):
+        summary = ProfitRollup.summary()
+        self.assertEqual(summary['grand_product_total'] or 0, quantity)
+        self.assertEqual(summary['grand_total_amount'] or 0, total_amount)
+
+    def test_list_shows_the_stock_on_hand(self):
+        self.product.deduct_quantity(3)
+        self.assertEqual(Product.objects.with_stock().get(pk=self.product.pk).stock, 7)
+
+    def test_deleting_a_product_with_pending_sales_clears_its_rollup(self):
+        self.product.deduct_quantity(3)
+        self.assertRollup(7, 14)
+        self.product.delete()
+        self.assertRollup(0, 0)
+
+    def test_price_change_applies_to_the_stock_on_hand(self):
+        self.product.deduct_quantity(3)
+        self.product.price = 3
+        self.product.save()
+        self.assertRollup(7, 21)
+
+    def test_stock_count_is_recorded_as_an_adjustment(self):
+        self.product.deduct_quantity(3)
+        self.assertEqual(self.product.set_stock(5), -2)
+        self.assertEqual(self.product.on_hand, 5)
+        self.assertEqual(StockMovement.objects.filter(reason="ADJUSTMENT").get().quantity, -2)
+        self.assertRollup(5, 10)
+
+
+class ProfitRollupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_product(create_category())
+        cls.day = ProfitRollup.day_of(cls.product.date)
+
+    def totals(self):
+        summary = ProfitRollup.summary()
+        return (summary['grand_product_total'] or 0, summary['grand_total_amount'] or 0,
+                summary['overall_profit'] or 0)
+
+    def test_rollup_state_counts_the_stock_on_hand(self):
+        self.assertEqual(self.product.rollup_state(), (self.day, 10, 20, 10))
+        self.assertEqual(self.product.rollup_state(pending=-4), (self.day, 6, 12, 6))
+        values = (self.product.date, 3, 1, 5)
+        self.assertEqual(self.product.rollup_state(values=values), (self.day, 5, 15, 10))
+
+    def test_rollup_state_unknown_for_expressions(self):
+        self.product.quantity = F('quantity') - 1
+        self.assertIsNone(self.product.rollup_state())
+
+    def test_record_changes_adds_the_differences(self):
+        old = self.product.rollup_state()
+        other_day = self.day - timedelta(days=1)
+        ProfitRollup.record_changes([
+            (old, (self.day, 12, 36, 24)),
+            (None, (other_day, 1, 5, 2)),
+            ((other_day, 1, 5, 2), None),
+        ])
+        self.assertEqual(self.totals(), (12, 36, 24))
+
+    def test_record_sale_at_the_products_price(self):
+        StockMovement.record({self.product.pk: -4})
+        ProfitRollup.record_sale({self.product: 4})
+        self.assertEqual(self.totals(), (6, 12, 6))
+        ProfitRollup.rebuild()
+        self.assertEqual(self.totals(), (6, 12, 6))
+
+    def test_sale_uses_the_price_read_under_the_lock(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        Product.objects.filter(pk=self.product.pk).update(price=3)
+        ProfitRollup.rebuild()
+        stale.deduct_quantity(4)
+        self.assertEqual(self.totals(), (6, 18, 12))
+        ProfitRollup.rebuild()
+        self.assertEqual(self.totals(), (6, 18, 12))
+
+    def test_writes_are_spread_over_the_shards(self):
+        with mock.patch('products.models.random.randrange', side_effect=range(1, 4)):
+            for _ in range(3):
+                # Through the ledger, so rebuild() agrees
+                self.product.deduct_quantity(1)
+        shards = set(ProfitRollup.objects.filter(day=self.day).values_list('shard', flat=True))
+        self.assertLessEqual({1, 2, 3}, shards)
+        self.assertEqual(self.totals(), (7, 14, 7))
+        ProfitRollup.rebuild()
+        self.assertEqual(list(ProfitRollup.objects.values_list('shard', flat=True)), [0])
+        self.assertEqual(self.totals(), (7, 14, 7))
+
+
+class CatalogChangesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = create_category()
+
+    def test_one_version_per_transaction(self):
+        since = CatalogChange.current_version()
+        CatalogChange.record([1, 2, 3])
+        self.assertEqual(CatalogChange.current_version(), since + 1)
+        self.assertEqual(set(CatalogChange.objects.filter(
+            version=since + 1).values_list('product_id', flat=True)), {1, 2, 3})
+
+    def test_changes_since_a_version(self):
+        soda = create_product(self.category)
+        since = CatalogChange.current_version()
+        water = create_product(self.category, "Water")
+        soda_pk = soda.pk
+        soda.delete()
+        changes = changes_since(since)
+        self.assertEqual(changes["version"], CatalogChange.current_version())
+        self.assertEqual([row[0] for row in changes["rows"]], [water.pk])
+        self.assertEqual(changes["deleted"], [soda_pk])
+
+
+class SearchIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = create_category()
+        cls.soda = create_product(cls.category)
+
+    def test_sees_changes_of_other_processes(self):
+        worker = ProductSearchIndex()
+        self.assertEqual([row['id'] for row in worker.search("soda")], [self.soda.pk])
+
+        # Saved by another worker, this process' index got no signal
+        Product.objects.filter(pk=self.soda.pk).update(name="Tonic")
+        CatalogChange.record([self.soda.pk])
+        self.assertEqual(worker.search("soda"), [])
+        self.assertEqual([row['id'] for row in worker.search("tonic")], [self.soda.pk])
+
+    def test_category_rename_refreshes_results(self):
+        worker = ProductSearchIndex()
+        self.assertEqual(worker.search("soda")[0]['category'], "Drinks")
+        self.category.name = "Beverages"
+        self.category.save()
+        self.assertEqual(worker.search("soda")[0]['category'], "Beverages")
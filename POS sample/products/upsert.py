@@ -0,0 +1,46 @@
+from functools import reduce
+from operator import or_
+from django.db.models import Case, F, Q, Value, When
+
+
+def add_to_rows(model, key_fields, increments):
+    """
+    Adds deltas to counter columns, creating the missing rows first.
+    Runs a fixed number of queries whatever the number of rows.
+    Must be called inside a transaction.
+
+    Args:
+        model: The model holding the counters
+        key_fields: The fields that identify a row, unique together
+        increments: Dict of {key tuple: {field: delta}}
+    """
+    if not increments:
+        return
+
+    keys = sorted(increments)
+
+    # Create the rows that don't exist yet
+    model.objects.bulk_create(
+        [model(**dict(zip(key_fields, key))) for key in keys],
+        ignore_conflicts=True,
+    )
+
+    # Lock the rows in a fixed order and map them by key
+    lookup = reduce(or_, [Q(**dict(zip(key_fields, key))) for key in keys])
+    rows = model.objects.select_for_update().filter(
+        lookup).order_by('pk').values_list('pk', *key_fields)
+    pks = {tuple(row[1:]): row[0] for row in rows}
+
+    # Add every delta in one statement
+    updates = {}
+    fields = {field for deltas in increments.values() for field in deltas}
+    for field in sorted(fields):
+        whens = [When(pk=pks[key], then=Value(deltas[field]))
+                 for key, deltas in increments.items() if deltas.get(field)]
+        if whens:
+            output_field = model._meta.get_field(field).__class__()
+            updates[field] = F(field) + Case(
+                *whens, default=Value(0), output_field=output_field)
+
+    if updates:
+        model.objects.filter(pk__in=pks.values()).update(**updates)
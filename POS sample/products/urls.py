@@ -17,14 +17,29 @@ urlpatterns = [
 
     # List products
     path('', views.ProductsListView, name='products_list'),
+    # Load more products (JSON)
+    path('more', views.ProductsMoreView, name='products_more'),
     # Add product
     path('add', views.ProductsAddView, name='products_add'),
+    # Import products in bulk (CSV / JSON)
+    path('import', views.ProductsImportView, name='products_import'),
     # Update product
     path('update/<str:product_id>',
          views.ProductsUpdateView, name='products_update'),
     # Delete product
     path('delete/<str:product_id>',
          views.ProductsDeleteView, name='products_delete'),
+    # Current stock of products
+    path("stock", views.ProductsStockView, name="products_stock"),
+    # Catalog snapshot and changes for the terminals
+    path("catalog", views.CatalogSnapshotView, name="catalog_snapshot"),
+    path("catalog/changes", views.CatalogChangesView, name="catalog_changes"),
     # Get products AJAX
     path("get", views.GetProductsAJAXView, name="get_products"),
+    # Products by scanned SKU/barcode
+    path("lookup", views.ProductsLookupView, name="products_lookup"),
+
+    # Async variants of the read-only views, for ASGI
+    path('async', views.ProductsListAsyncView, name='products_list_async'),
+    path("async/get", views.GetProductsAsyncView, name="get_products_async"),
 ]
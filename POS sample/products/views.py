@@ -1,10 +1,21 @@
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from datetime import date, timedelta
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.shortcuts import render, redirect
-from .models import Category, Product
-from django.db.models import F, Sum
+from .models import Category, Product, ProfitRollup, StockMovement
+from .search import index
+from .barcodes import MAX_CODES, barcodes
+from .pagination import apaginate_request, paginate_request
+from .decorators import async_login_required
+from asgiref.sync import sync_to_async
+from .importer import import_rows, read_rows
+import io
+import gzip
+import json
+from .catalog import changes_since, snapshot
+from django.db import IntegrityError, transaction
 
 
 @login_required(login_url="/accounts/login/")
@@ -33,22 +44,18 @@ def CategoriesAddView(request):
             "description": data['description']
         }
 
-        # Check if a category with the same attributes exists
-        if Category.objects.filter(**attributes).exists():
-            messages.error(request, 'Category already exists!',
-                           extra_tags="warning")
-            return redirect('products:categories_add')
-
         try:
-            # Create the category
-            new_category = Category.objects.create(**attributes)
-
-            # If it doesn't exists save it
-            new_category.save()
+            # Create the category, the unique fingerprint rejects duplicates
+            with transaction.atomic():
+                Category.objects.create(**attributes)
 
             messages.success(request, 'Category: ' +
                              attributes["name"] + ' created succesfully!', extra_tags="success")
             return redirect('products:categories_list')
+        except IntegrityError:
+            messages.error(request, 'Category already exists!',
+                           extra_tags="warning")
+            return redirect('products:categories_add')
         except Exception as e:
             messages.success(
                 request, 'There was an error during the creation!', extra_tags="danger")
@@ -92,21 +99,19 @@ def CategoriesUpdateView(request, category_id):
                 "description": data['description']
             }
 
-            # Check if a category with the same attributes exists
-            if Category.objects.filter(**attributes).exists():
-                messages.error(request, 'Category already exists!',
-                               extra_tags="warning")
-                return redirect('products:categories_add')
-
-            # Get the category to update
-            category = Category.objects.filter(
-                id=category_id).update(**attributes)
-
-            category = Category.objects.get(id=category_id)
+            # Update the category, the unique fingerprint rejects duplicates
+            for field, value in attributes.items():
+                setattr(category, field, value)
+            with transaction.atomic():
+                category.save()
 
             messages.success(request, '¡Category: ' + category.name +
                              ' updated successfully!', extra_tags="success")
             return redirect('products:categories_list')
+        except IntegrityError:
+            messages.error(request, 'Category already exists!',
+                           extra_tags="warning")
+            return redirect('products:categories_update', category_id=category_id)
         except Exception as e:
             messages.success(
                 request, 'There was an error during the elimination!', extra_tags="danger")
@@ -139,46 +144,55 @@ def CategoriesDeleteView(request, category_id):
 @login_required(login_url="/accounts/login/")
 def ProductsListView(request):
 
-     # Calculate daily profit
-    today = date.today()
-    start_date = today - timedelta(days=1)
-    daily_profit = Product.objects.filter(date__date=today).aggregate(total_profit=Sum((F('price') - F('buying_price')) * F('quantity')))['total_profit']
-    
-    # Calculate weekly profit
-    start_of_week = today - timedelta(days=today.weekday())
-    end_of_week = start_of_week + timedelta(days=6)
-    weekly_profit = Product.objects.filter(date__date__range=[start_of_week, end_of_week]).aggregate(total_profit=Sum((F('price') - F('buying_price')) * F('quantity')))['total_profit']
-    
-    # Calculate monthly profit
-    start_of_month = date(today.year, today.month, 1)
-    end_of_month = date(today.year, today.month, 1) + timedelta(days=32)
-    monthly_profit = Product.objects.filter(date__date__range=[start_of_month, end_of_month]).aggregate(total_profit=Sum((F('price') - F('buying_price')) * F('quantity')))['total_profit']
-
-
-     # Calculate overall profit
-    overall_profit = Product.objects.annotate(
-        profit=(F('price') - F('buying_price')) * F('quantity')
-    ).aggregate(total_profit=Sum('profit'))['total_profit']
-
-   
-    products = Product.objects.all().order_by('-date')
-    grand_product_total =  grand_product_total = products.aggregate(total=Sum('quantity'))['total']
-    grand_total_amount = products.aggregate(total_amount_sum=Sum('total_amount'))['total_amount_sum'] or 0
+    # Read the profits and grand totals from the pre-summed rollup
+    summary = ProfitRollup.summary()
+
+    # Only one page of products is loaded
+    products = paginate_request(
+        request, Product.objects.select_related('category').with_stock())
+    grand_product_total = summary['grand_product_total'] or 0
+    grand_total_amount = summary['grand_total_amount'] or 0
 
     context = {
         "active_icon": "products",
         "products": products,
+        "next_cursor": products.next_cursor,
+        "previous_cursor": products.previous_cursor,
         "grand_product_total": grand_product_total,
         "grand_total_amount": grand_total_amount,
-        'overall_profit': overall_profit or 0 ,
-        'daily_profit': daily_profit,
-        'weekly_profit': weekly_profit,
-        'monthly_profit': monthly_profit,
+        'overall_profit': summary['overall_profit'] or 0,
+        'daily_profit': summary['daily_profit'],
+        'weekly_profit': summary['weekly_profit'],
+        'monthly_profit': summary['monthly_profit'],
 
     }
     return render(request, "products/products.html", context=context)
 
 
+@login_required(login_url="/accounts/login/")
+def ProductsMoreView(request):
+    """
+    Returns the next page of products for the "load more" button
+    """
+    products = paginate_request(
+        request, Product.objects.select_related('category').with_stock())
+    return JsonResponse({
+        "products": [dict(product.to_json(), stock=product.stock) for product in products],
+        "next_cursor": products.next_cursor,
+        "previous_cursor": products.previous_cursor,
+    })
+
+
+def duplicate_product_message(sku, product_id=None):
+    """
+    Tells which unique column a product save collided on, the barcode or
+    the name and category
+    """
+    if sku and Product.objects.filter(sku=sku).exclude(pk=product_id).exists():
+        return 'Barcode ' + sku + ' is already used by another product!'
+    return 'Product already exists!'
+
+
 @login_required(login_url="/accounts/login/")
 def ProductsAddView(request):
     context = {
@@ -201,6 +215,7 @@ def ProductsAddView(request):
             "buying_price": float(data['buying_price']),
             "price": float(data['price']),
             "quantity": int(data['quantity']),
+            "sku": data.get('sku', '').strip() or None,
         }
 
         # Calculate total_amount
@@ -209,24 +224,21 @@ def ProductsAddView(request):
          # Calculate profit
         attributes['profit_amount'] = attributes['price'] - attributes['buying_price']
 
-        # Check if a product with the same attributes exists
-        if Product.objects.filter(**attributes).exists():
-            messages.error(request, 'Product already exists!',
-                           extra_tags="warning")
-            return redirect('products:products_add')
-
         try:
-            # Create the product
-            new_product = Product.objects.create(**attributes)
+            # Create the product, the unique fingerprint rejects duplicates
+            with transaction.atomic():
+                new_product = Product.objects.create(**attributes)
 
             # Calculate and retrieve the profit value
             profit = new_product.profit
-            # If it doesn't exists save it
-            new_product.save()
 
             messages.success(request, 'Product: ' +
                              attributes["name"] + ' created succesfully! Profit:' + str(profit), extra_tags="success")
             return redirect('products:products_list')
+        except IntegrityError:
+            messages.error(request, duplicate_product_message(attributes["sku"]),
+                           extra_tags="warning")
+            return redirect('products:products_add')
         except Exception as e:
             messages.success(
                 request, 'There was an error during the creation!', extra_tags="danger")
@@ -236,6 +248,26 @@ def ProductsAddView(request):
     return render(request, "products/products_add.html", context=context)
 
 
+@login_required(login_url="/accounts/login/")
+def ProductsImportView(request):
+    """
+    Imports the CSV or JSON file posted as "file", "key" is id or name.
+    Returns the import report
+    """
+    if request.method != 'POST' or 'file' not in request.FILES:
+        return JsonResponse({"error": "Post a CSV or JSON file as 'file'"}, status=400)
+
+    upload = request.FILES['file']
+    file_format = 'json' if upload.name.lower().endswith('.json') else 'csv'
+    key = request.POST.get('key', 'id')
+    try:
+        rows = read_rows(io.TextIOWrapper(upload.file, encoding='utf-8', newline=''), file_format)
+        report = import_rows(rows, key=key)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse(report.to_json())
+
+
 @login_required(login_url="/accounts/login/")
 def ProductsUpdateView(request, product_id):
     """
@@ -246,7 +278,7 @@ def ProductsUpdateView(request, product_id):
     # Get the product
     try:
         # Get the product to update
-        product = Product.objects.get(id=product_id)
+        product = Product.objects.with_stock().get(id=product_id)
     except Exception as e:
         messages.success(
             request, 'There was an error trying to get the product!', extra_tags="danger")
@@ -257,6 +289,7 @@ def ProductsUpdateView(request, product_id):
         "active_icon": "products",
         "product_status": Product.status.field.choices,
         "product": product,
+        "stock": product.stock,
         "categories": Category.objects.all()
     }
 
@@ -270,27 +303,32 @@ def ProductsUpdateView(request, product_id):
                 "status": data['status'],
                 "description": data['description'],
                 "category": Category.objects.get(id=data['category']),
-                "buying_price": data['buying_price'],
-                "price": data['price'],
-                "quantity": data['quantity'],
-                "total_amount": data['total_amount'],
+                "buying_price": float(data['buying_price']),
+                "price": float(data['price']),
             }
-
-            # Check if a product with the same attributes exists
-            if product.objects.filter(**attributes).exists():
-                messages.error(request, 'Product already exists!',
-                               extra_tags="warning")
-                return redirect('products:products_add')
-
-            # Get the product to update
-            product = Product.objects.filter(
-                id=product_id).update(**attributes)
-
-            product = Product.objects.get(id=product_id)
+            # Forms without the field keep the barcode
+            if 'sku' in data:
+                attributes["sku"] = data['sku'].strip() or None
+            # The quantity is a stock count, the snapshot isn't overwritten
+            count = int(data['quantity'])
+
+            # Update the product, save() recomputes the amounts and the
+            # unique fingerprint rejects duplicates
+            for field, value in attributes.items():
+                setattr(product, field, value)
+            with transaction.atomic():
+                product.save()
+                # Left as shown, the snapshot or the stock on hand: no count
+                if count not in (product.quantity, product.stock):
+                    product.set_stock(count)
 
             messages.success(request, '¡Product: ' + product.name +
                              ' updated successfully!', extra_tags="success")
             return redirect('products:products_list')
+        except IntegrityError:
+            messages.error(request, duplicate_product_message(product.sku, product.pk),
+                           extra_tags="warning")
+            return redirect('products:products_update', product_id=product_id)
         except Exception as e:
             messages.success(
                 request, 'There was an error during the update!', extra_tags="danger")
@@ -320,6 +358,19 @@ def ProductsDeleteView(request, product_id):
         return redirect('products:products_list')
 
 
+@login_required(login_url="/accounts/login/")
+def ProductsStockView(request):
+    """
+    Returns the current stock of the products given as ?ids=1,2,3
+    """
+    try:
+        ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk]
+    except ValueError:
+        return JsonResponse({"error": "ids must be a comma separated list of IDs"}, status=400)
+    stock = StockMovement.on_hand(ids)
+    return JsonResponse({str(pk): quantity for pk, quantity in stock.items()})
+
+
 def is_ajax(request):
     return request.META.get('HTTP_X_REQUESTED_WITH') == 'XMLHttpRequest'
 
@@ -328,12 +379,103 @@ def is_ajax(request):
 def GetProductsAJAXView(request):
     if request.method == 'POST':
         if is_ajax(request=request):
-            data = []
-
-            products = Product.objects.filter(
-                name__icontains=request.POST['term'])
-            for product in products[0:10]:
-                item = product.to_json()
-                data.append(item)
+            data = index.search(request.POST['term'], limit=10)
 
             return JsonResponse(data, safe=False)
+    return JsonResponse({"error": "Post the term with X-Requested-With"}, status=400)
+
+
+@login_required(login_url="/accounts/login/")
+def ProductsLookupView(request):
+    """
+    Products by exact SKU/barcode, the codes are given as ?codes=A,B or
+    posted as {"codes": [...]}. Served from the in-process barcode map.
+    """
+    if request.method == 'POST':
+        try:
+            codes = json.loads(request.body)["codes"]
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({"error": "Post the codes as {\"codes\": [...]}"}, status=400)
+        if not isinstance(codes, list):
+            return JsonResponse({"error": "codes must be a list"}, status=400)
+    else:
+        codes = request.GET.get('codes', '').split(',')
+
+    codes = [str(code).strip() for code in codes if str(code).strip()]
+    if len(codes) > MAX_CODES:
+        return JsonResponse({"error": "At most " + str(MAX_CODES) + " codes per lookup"}, status=400)
+
+    found = barcodes.lookup(codes)
+    return JsonResponse({
+        "products": found,
+        "missing": [code for code in codes if code not in found],
+    })
+
+
+@login_required(login_url="/accounts/login/")
+def CatalogSnapshotView(request):
+    """
+    Full snapshot of the active products for the terminals, gzipped
+    """
+    version, body = snapshot()
+    etag = quote_etag("catalog-" + str(version))
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        return not_modified
+
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(body, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(body), content_type='application/json')
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@login_required(login_url="/accounts/login/")
+def CatalogChangesView(request):
+    """
+    Products changed after the version given as ?since=N
+    """
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        return JsonResponse({"error": "since must be a catalog version"}, status=400)
+    return JsonResponse(changes_since(since))
+
+
+@async_login_required(login_url="/accounts/login/")
+async def ProductsListAsyncView(request):
+    """
+    ProductsListView for ASGI, the queries don't hold a worker thread
+    """
+    summary = await ProfitRollup.asummary()
+    products = await apaginate_request(
+        request, Product.objects.select_related('category').with_stock())
+
+    context = {
+        "active_icon": "products",
+        "products": products,
+        "next_cursor": products.next_cursor,
+        "previous_cursor": products.previous_cursor,
+        "grand_product_total": summary['grand_product_total'] or 0,
+        "grand_total_amount": summary['grand_total_amount'] or 0,
+        'overall_profit': summary['overall_profit'] or 0,
+        'daily_profit': summary['daily_profit'],
+        'weekly_profit': summary['weekly_profit'],
+        'monthly_profit': summary['monthly_profit'],
+    }
+    return await sync_to_async(render)(request, "products/products.html", context=context)
+
+
+@async_login_required(login_url="/accounts/login/")
+async def GetProductsAsyncView(request):
+    """
+    GetProductsAJAXView for ASGI
+    """
+    if request.method == 'POST' and is_ajax(request=request):
+        data = await index.asearch(request.POST['term'], limit=10)
+        return JsonResponse(data, safe=False)
+    return JsonResponse({"error": "Post the term with X-Requested-With"}, status=400)
@@ -2,5 +2,20 @@ from django.contrib import admin
 
 from .models import Sale, SaleDetail
 
-admin.site.register(Sale)
+
+class SaleDetailInline(admin.TabularInline):
+    model = SaleDetail
+    extra = 0
+
+
+@admin.register(Sale)
+class SaleAdmin(admin.ModelAdmin):
+    inlines = [SaleDetailInline]
+
+    def save_related(self, request, form, formsets, change):
+        # The inline saves every detail, the totals are updated once
+        with form.instance.deferred_totals():
+            super().save_related(request, form, formsets, change)
+
+
 admin.site.register(SaleDetail)
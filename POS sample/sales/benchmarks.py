@@ -0,0 +1,270 @@
+import asyncio
+import json
+import platform
+import random
+import time
+from urllib.parse import urlencode
+import django
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import AsyncClient, Client, modify_settings
+from django.urls import reverse
+from django.utils import timezone
+from customers.models import Customer
+from products.models import Category, Product, ProfitRollup
+from products.search import index
+from .models import Sale
+
+CART_SIZES = (1, 10, 100)
+CATALOG_SIZES = (1000, 100000)
+CONCURRENCY = (1, 10, 50)
+SEARCH_TERMS = ("so", "sod", "soda", "product 1", "cola 99", "zzz")
+# AsyncClient sends its extra arguments as raw header names, an HTTP_
+# prefixed META key never reaches the view
+ASYNC_AJAX_HEADERS = {"X-Requested-With": "XMLHttpRequest"}
+# AsyncClient can't have a multipart body parsed on Django 4.1, the
+# search terms are posted url encoded
+FORM_CONTENT_TYPE = "application/x-www-form-urlencoded"
+
+
+def percentile(samples, percent):
+    """
+    Nearest-rank percentile of the samples
+    """
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+class Benchmark:
+    """
+    Runs the POS hot paths through the full request stack and collects
+    throughput and latency percentiles
+    """
+
+    def __init__(self, iterations=200, seed=42):
+        self.iterations = iterations
+        self.random = random.Random(seed)
+        self.results = []
+        self.client = Client()
+        self.user = None
+        self.customer = None
+
+    def setup(self):
+        self.user, _ = User.objects.get_or_create(username="benchmark")
+        self.client.force_login(self.user)
+        self.customer = Customer.objects.create(first_name="Bench", last_name="Mark")
+
+    def seed_products(self, count):
+        """
+        Tops the catalog up to count products with bulk_create
+        """
+        category, _ = Category.objects.get_or_create(
+            name="Benchmark", defaults={"description": "Benchmark", "status": "ACTIVE"})
+        existing = Product.objects.count()
+        names = ("Soda", "Cola", "Water", "Juice", "Chips", "Bread", "Milk", "Coffee")
+        products = [
+            Product(name=names[i % len(names)] + " product " + str(i), description="Benchmark",
+                    status="ACTIVE", category=category, buying_price=1, price=2,
+                    quantity=1000000, total_amount=2000000, profit_amount=1000000)
+            for i in range(existing, count)
+        ]
+        for product in products:
+            product.fingerprint = product.identity()
+        Product.objects.bulk_create(products, batch_size=5000)
+        ProfitRollup.rebuild()
+        index.build()
+
+    def measure(self, name, request, iterations=None, **meta):
+        """
+        Args:
+            name: Name of the scenario in the report
+            request: Callable doing one request, returns the response
+            iterations: Overrides the default number of requests
+        """
+        iterations = iterations or self.iterations
+        latencies = []
+        queries = []
+
+        # Warm up the caches and the connection
+        request()
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            start = time.perf_counter()
+            response = request()
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                raise RuntimeError(name + " answered " + str(response.status_code))
+            timings = getattr(response, "timings", None)
+            if timings is not None:
+                queries.append(timings.queries)
+        elapsed = time.perf_counter() - started
+
+        if queries:
+            meta["queries_per_request"] = max(queries)
+        return self.record(name, latencies, elapsed, **meta)
+
+    def record(self, name, latencies, elapsed, **meta):
+        iterations = len(latencies)
+        result = {
+            "name": name,
+            "iterations": iterations,
+            "throughput_rps": round(iterations / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "max_ms": round(max(latencies), 3),
+        }
+        result.update(meta)
+        self.results.append(result)
+        return result
+
+    def checkout(self, cart_size):
+        products = list(Product.objects.values('id', 'price', 'buying_price')[:max(cart_size, 1) * 5])
+
+        def request():
+            cart = [{"id": p["id"], "price": p["price"], "quantity": 1,
+                     "total_product": p["price"], "buying_price": p["buying_price"]}
+                    for p in self.random.sample(products, cart_size)]
+            return self.client.post(
+                reverse('sales:sales_add'),
+                data=json.dumps({"customer": self.customer.id, "sub_total": 0,
+                                 "tax_percentage": 10, "amount_payed": 100000,
+                                 "products": cart}),
+                content_type='application/json',
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        iterations = max(10, self.iterations // max(1, cart_size // 10))
+        before = Sale.objects.count()
+        result = self.measure("checkout_" + str(cart_size) + "_lines", request,
+                              iterations=iterations, cart_size=cart_size)
+        # A failed checkout still redirects, count the sales instead. One
+        # more for the warm up request.
+        created = Sale.objects.count() - before
+        if created != iterations + 1:
+            raise RuntimeError("checkout_" + str(cart_size) + "_lines created " + str(created)
+                               + " sales out of " + str(iterations + 1) + " requests")
+        return result
+
+    def products_list(self, catalog_size):
+        url = reverse('products:products_list')
+        return self.measure("products_list_" + str(catalog_size), lambda: self.client.get(url),
+                            catalog_size=catalog_size)
+
+    def search(self, catalog_size):
+        url = reverse('products:get_products')
+
+        def request():
+            return self.client.post(url, {"term": self.random.choice(SEARCH_TERMS)},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        return self.measure("search_" + str(catalog_size), request, catalog_size=catalog_size)
+
+    def receipt(self, cached):
+        """
+        Returns None when there is no sale to print
+        """
+        sale = Sale.objects.order_by('-id').first()
+        if sale is None:
+            return None
+        url = reverse('sales:sales_receipt_pdf', args=[sale.id])
+
+        def request():
+            if not cached:
+                cache.clear()
+            response = self.client.get(url)
+            # Until the render is done, the till polls the same way
+            while response.status_code == 202:
+                time.sleep(0.01)
+                response = self.client.get(url)
+            return response
+
+        iterations = self.iterations if cached else max(10, self.iterations // 10)
+        return self.measure("receipt_pdf_" + ("cached" if cached else "render"), request,
+                            iterations=iterations)
+
+    async def concurrent_requests(self, client, request, concurrency, total):
+        """
+        Sends total requests keeping concurrency of them in flight
+
+        Returns the latencies and the elapsed seconds
+        """
+        latencies = []
+        pending = iter(range(total))
+
+        async def worker():
+            for _ in pending:
+                start = time.perf_counter()
+                response = await request(client)
+                latencies.append((time.perf_counter() - start) * 1000)
+                if response.status_code >= 400:
+                    raise RuntimeError("Answered " + str(response.status_code))
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        return latencies, time.perf_counter() - started
+
+    def concurrency(self, levels=CONCURRENCY):
+        """
+        Compares the sync and async variants of the read-only views under
+        concurrent requests on a single event loop, like one ASGI worker
+        """
+        client = AsyncClient()
+        client.force_login(self.user)
+        sale = Sale.objects.order_by('-id').first()
+
+        def search(url_name):
+            url = reverse(url_name)
+            return lambda c: c.post(url, urlencode({"term": self.random.choice(SEARCH_TERMS)}),
+                                    content_type=FORM_CONTENT_TYPE, **ASYNC_AJAX_HEADERS)
+
+        def details(url_name):
+            url = reverse(url_name, args=[sale.id])
+            return lambda c: c.get(url)
+
+        scenarios = [
+            ("search", "sync", search('products:get_products')),
+            ("search", "async", search('products:get_products_async')),
+        ]
+        if sale is not None:
+            scenarios += [
+                ("sale_details", "sync", details('sales:sales_details')),
+                ("sale_details", "async", details('sales:sales_details_async')),
+            ]
+        for name, variant, request in scenarios:
+            for level in levels:
+                latencies, elapsed = async_to_sync(self.concurrent_requests)(
+                    client, request, level, max(self.iterations, level))
+                self.record(name + "_" + variant + "_c" + str(level), latencies, elapsed,
+                            variant=variant, concurrency=level)
+
+    def run(self, cart_sizes=CART_SIZES, catalog_sizes=CATALOG_SIZES, receipts=True):
+        with modify_settings(MIDDLEWARE={'append': 'products.instrumentation.ServerTimingMiddleware'}):
+            self.setup()
+            self.seed_products(max(max(cart_sizes) * 5, min(catalog_sizes)))
+            for cart_size in cart_sizes:
+                self.checkout(cart_size)
+            for catalog_size in sorted(catalog_sizes):
+                self.seed_products(catalog_size)
+                self.products_list(catalog_size)
+                self.search(catalog_size)
+            if receipts:
+                self.receipt(cached=False)
+                self.receipt(cached=True)
+            self.concurrency()
+        return self.report()
+
+    def report(self):
+        return {
+            "meta": {
+                "date": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "iterations": self.iterations,
+            },
+            "results": self.results,
+        }
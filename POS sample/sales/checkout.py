@@ -0,0 +1,180 @@
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from products.models import ProfitRollup
+from products.stock import InsufficientStock, lock_products, take
+from .models import IdempotencyKey, Sale, SaleDetail
+from . import counters, leaderboard, summaries
+
+# How long a retried checkout is answered from the cache
+IDEMPOTENCY_CACHE_TIMEOUT = 60 * 60 * 24
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+
+class CheckoutError(Exception):
+    """
+    Raised when a cart can't be turned into a sale
+    """
+
+
+def parse_cart(products):
+    """
+    Args:
+        products: The cart lines posted by the till
+
+    Returns the cart as a list of (product_id, price, quantity) tuples
+    """
+    lines = []
+    for product in products:
+        try:
+            line = (int(product["id"]), float(product["price"]),
+                    int(product["quantity"]))
+        except (KeyError, TypeError, ValueError):
+            raise CheckoutError("Invalid cart line: " + str(product))
+        if line[2] <= 0:
+            raise CheckoutError("Invalid quantity for product " + str(line[0]))
+        lines.append(line)
+
+    if not lines:
+        raise CheckoutError("The cart is empty")
+    return lines
+
+
+def idempotency_cache_key(key):
+    return "checkout-key:" + key
+
+
+def replayed_sale(key):
+    """
+    Returns the sale already created with the key, or None
+    """
+    sale = cache.get(idempotency_cache_key(key))
+    if sale is None:
+        record = IdempotencyKey.objects.select_related('sale').filter(key=key).first()
+        if record is None:
+            return None
+        sale = record.sale
+        cache.set(idempotency_cache_key(key), sale, IDEMPOTENCY_CACHE_TIMEOUT)
+    sale.replayed = True
+    return sale
+
+
+def checkout(customer_id, products, tax_percentage=0, amount_payed=0, key=None):
+    """
+    Creates a sale with all its details in a single transaction.
+    The number of queries doesn't depend on the size of the cart.
+
+    Args:
+        customer_id: ID of the customer buying
+        products: The cart lines posted by the till
+        tax_percentage: Tax applied over the sub total
+        amount_payed: The amount the customer handed over
+        key: Idempotency key sent by the till, a retry with the same key
+             returns the first sale instead of creating another one
+
+    Returns the new Sale, or the first one with replayed set for a retry
+    """
+    lines = parse_cart(products)
+
+    if key is None:
+        sale = create_sale(customer_id, lines, tax_percentage, amount_payed)
+        sale.replayed = False
+        return sale
+
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise CheckoutError("Invalid idempotency key")
+
+    sale = replayed_sale(key)
+    if sale is not None:
+        return sale
+
+    try:
+        sale = create_sale(customer_id, lines, tax_percentage, amount_payed, key)
+    except (IntegrityError, CheckoutError):
+        # A concurrent checkout with the same key committed first, this
+        # transaction was rolled back with everything it wrote. It either
+        # failed on the key or, having waited on the stock locks, found
+        # the stock already taken by the first one.
+        sale = replayed_sale(key)
+        if sale is None:
+            raise
+        return sale
+
+    sale.replayed = False
+    cache.set(idempotency_cache_key(key), sale, IDEMPOTENCY_CACHE_TIMEOUT)
+    return sale
+
+
+def create_sale(customer_id, lines, tax_percentage, amount_payed, key=None):
+    with transaction.atomic():
+        # Lock the cart's products in ID order and load them, the prices
+        # used for the sale and the rollup are read under the locks
+        catalog = lock_products({line[0] for line in lines})
+        missing = {line[0] for line in lines} - set(catalog)
+        if missing:
+            raise CheckoutError(
+                "Products not found: " + ", ".join(str(i) for i in sorted(missing)))
+
+        # Build the details and the quantity sold per product
+        details = []
+        sold = {}
+        for product_id, price, quantity in lines:
+            buying_price = catalog[product_id].buying_price
+            total_detail = price * quantity
+            details.append(SaleDetail(
+                product_id=product_id,
+                price=price,
+                quantity=quantity,
+                total_detail=total_detail,
+                buying_price=buying_price,
+                profit=total_detail - buying_price * quantity if buying_price else 0.0,
+            ))
+            sold[product_id] = sold.get(product_id, 0) + quantity
+
+        # Take the whole cart out of the stock, or nothing
+        try:
+            take(catalog, sold)
+        except InsufficientStock as e:
+            raise CheckoutError(str(e)) from e
+
+        # Compute the sale totals once
+        sub_total = sum(detail.total_detail for detail in details)
+        tax_amount = sub_total * (tax_percentage / 100)
+        grand_total = sub_total + tax_amount
+
+        sale = Sale.objects.create(
+            customer_id=customer_id,
+            sub_total=sub_total,
+            grand_total=grand_total,
+            tax_amount=tax_amount,
+            tax_percentage=tax_percentage,
+            amount_payed=amount_payed,
+            amount_change=amount_payed - grand_total,
+            profit=sum(detail.profit for detail in details),
+        )
+
+        for detail in details:
+            detail.sale = sale
+        SaleDetail.objects.bulk_create(details)
+
+        ProfitRollup.record_sale(
+            {catalog[product_id]: quantity for product_id, quantity in sold.items()})
+
+        summaries.record(sale.date, [
+            (detail.product_id, catalog[detail.product_id].category_id,
+             detail.quantity, detail.total_detail, detail.profit)
+            for detail in details
+        ])
+        lines = [(detail.product_id, detail.quantity, detail.total_detail, detail.profit)
+                 for detail in details]
+        transaction.on_commit(lambda: leaderboard.record(sale.date, lines))
+
+        # Update the store-wide totals on one shard each
+        counters.increment(counters.GRAND_PRODUCT_TOTAL, -sub_total)
+        counters.increment(counters.GRAND_TOTAL_AMOUNT, grand_total)
+
+        if key is not None:
+            # Last so the key is held for the shortest time, a concurrent
+            # duplicate blocks on it until this commits and then fails
+            IdempotencyKey.objects.create(key=key, sale=sale)
+
+    return sale
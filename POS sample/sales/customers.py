@@ -0,0 +1,45 @@
+import hashlib
+from django.core.cache import cache
+from django.db.models import Q
+from customers.models import Customer
+
+PAGE_SIZE = 20
+# Seconds a page of results is served from the cache
+CACHE_TTL = 30
+
+
+def to_select2(row):
+    # Same shape as Customer.to_select2, built from the values() row
+    name = " ".join(part for part in (row["first_name"], row["last_name"]) if part)
+    return {"label": name, "value": row["id"]}
+
+
+def search_customers(term, page=1):
+    """
+    Args:
+        term: Start of the customer's first or last name, or its ID
+        page: Page of results, from 1
+
+    Returns {"results": [to_select2 items], "pagination": {"more": bool}}
+    """
+    term = " ".join(term.split())
+    key = "customers:" + hashlib.md5(term.lower().encode()).hexdigest() + ":" + str(page)
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    customers = Customer.objects.order_by('first_name', 'last_name', 'id')
+    if term:
+        lookup = Q(first_name__istartswith=term) | Q(last_name__istartswith=term)
+        if term.isdigit():
+            lookup |= Q(id=int(term))
+        customers = customers.filter(lookup)
+
+    offset = (page - 1) * PAGE_SIZE
+    rows = list(customers.values('id', 'first_name', 'last_name')[offset:offset + PAGE_SIZE + 1])
+    data = {
+        "results": [to_select2(row) for row in rows[:PAGE_SIZE]],
+        "pagination": {"more": len(rows) > PAGE_SIZE},
+    }
+    cache.set(key, data, CACHE_TTL)
+    return data
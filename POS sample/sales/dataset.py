@@ -0,0 +1,177 @@
+import random
+from datetime import datetime, time, timedelta
+from itertools import accumulate
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from customers.models import Customer
+from products.models import Category, Product, ProfitRollup
+from .models import Sale, SaleDetail
+from . import summaries
+
+# Share of the day's sales per hour, peaks at lunch and after work
+HOURLY_WEIGHTS = (
+    0, 0, 0, 0, 0, 0, 1, 2, 4, 5, 6, 8,
+    10, 9, 6, 5, 6, 8, 10, 9, 6, 3, 1, 0,
+)
+# Monday to Sunday
+WEEKDAY_WEIGHTS = (10, 10, 11, 11, 13, 16, 12)
+QUANTITY_WEIGHTS = ((1, 70), (2, 18), (3, 7), (4, 3), (6, 2))
+
+FIRST_NAMES = ("Ana", "Ben", "Carla", "David", "Elena", "Frank", "Grace", "Hugo",
+               "Irene", "John", "Kate", "Luis", "Maria", "Nick", "Olga", "Peter")
+LAST_NAMES = ("Smith", "Garcia", "Brown", "Lopez", "Wilson", "Martin", "Lee",
+              "Clark", "Lewis", "Walker", "Young", "King", "Scott", "Green")
+PRODUCT_WORDS = ("Soda", "Cola", "Water", "Juice", "Chips", "Bread", "Milk", "Coffee",
+                 "Tea", "Rice", "Beans", "Pasta", "Soap", "Candy", "Cookies", "Cheese")
+SIZES = ("Small", "Medium", "Large", "Family", "Mini", "XL")
+
+
+class DatasetGenerator:
+    """
+    Seeded generator of a realistic POS dataset written with bulk_create.
+    Product popularity follows a Zipf law and the sales follow a
+    time-of-day and day-of-week curve.
+    """
+
+    def __init__(self, seed=42, batch_size=10000, zipf=1.1, log=None):
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.zipf = zipf
+        self.log = log or (lambda message: None)
+
+    def categories(self, count):
+        categories = [
+            Category(name="Category " + str(i), description="Generated category " + str(i),
+                     status="ACTIVE")
+            for i in range(count)
+        ]
+        # bulk_create skips save(), set the fingerprints here
+        for category in categories:
+            category.fingerprint = category.identity()
+        Category.objects.bulk_create(categories, batch_size=self.batch_size)
+        self.log("Categories: " + str(len(categories)))
+        return [category.id for category in categories]
+
+    def products(self, count, category_ids, days):
+        created = []
+        start = timezone.now() - timedelta(days=days)
+        for offset in range(0, count, self.batch_size):
+            batch = []
+            for i in range(offset, min(offset + self.batch_size, count)):
+                buying_price = round(self.random.uniform(0.5, 50), 2)
+                price = round(buying_price * self.random.uniform(1.1, 1.6), 2)
+                quantity = self.random.randint(0, 500)
+                batch.append(Product(
+                    date=start + timedelta(seconds=self.random.randrange(days * 86400)),
+                    name=" ".join((self.random.choice(PRODUCT_WORDS),
+                                   self.random.choice(SIZES), str(i))),
+                    description="Generated product",
+                    status="ACTIVE" if self.random.random() < 0.95 else "INACTIVE",
+                    category_id=self.random.choice(category_ids),
+                    buying_price=buying_price, price=price, quantity=quantity,
+                    total_amount=price * quantity,
+                    profit_amount=(price - buying_price) * quantity,
+                ))
+            for product in batch:
+                product.fingerprint = product.identity()
+            created.extend(Product.objects.bulk_create(batch))
+            self.log("Products: " + str(len(created)))
+        return [(p.id, p.price, p.buying_price) for p in created]
+
+    def customers(self, count):
+        created = []
+        for offset in range(0, count, self.batch_size):
+            created.extend(Customer.objects.bulk_create([
+                Customer(first_name=self.random.choice(FIRST_NAMES),
+                         last_name=self.random.choice(LAST_NAMES) + " " + str(i))
+                for i in range(offset, min(offset + self.batch_size, count))
+            ]))
+            self.log("Customers: " + str(len(created)))
+        return [customer.id for customer in created]
+
+    def sale_dates(self, count, days):
+        """
+        Returns count sale datetimes over the last days, sorted
+        """
+        today = timezone.localdate()
+        day_list = [today - timedelta(days=d) for d in range(days)]
+        day_weights = [WEEKDAY_WEIGHTS[day.weekday()] for day in day_list]
+        chosen_days = self.random.choices(day_list, weights=day_weights, k=count)
+        hours = self.random.choices(range(24), weights=HOURLY_WEIGHTS, k=count)
+
+        dates = []
+        for day, hour in zip(chosen_days, hours):
+            moment = datetime.combine(day, time(hour)) + timedelta(seconds=self.random.randrange(3600))
+            dates.append(timezone.make_aware(moment) if settings.USE_TZ else moment)
+        dates.sort()
+        return dates
+
+    def sales(self, lines, products, customer_ids, days, lines_per_sale=5, tax_percentage=10):
+        """
+        Creates sales until there are the requested number of sale lines
+        """
+        # Most popular products first, drawn with Zipf weights
+        ranked = products[:]
+        self.random.shuffle(ranked)
+        cum_weights = list(accumulate(1 / (rank ** self.zipf) for rank in range(1, len(ranked) + 1)))
+        quantities, quantity_weights = zip(*QUANTITY_WEIGHTS)
+
+        # Cart sizes first, at least one line and lines_per_sale on average,
+        # so there is one date per sale
+        sizes = []
+        remaining = lines
+        while remaining > 0:
+            extra = self.random.expovariate(1 / max(lines_per_sale - 1, 0.1))
+            sizes.append(min(remaining, 1 + int(extra)))
+            remaining -= sizes[-1]
+        dates = self.sale_dates(len(sizes), days)
+
+        created_lines = 0
+        created_sales = 0
+        per_batch = self.batch_size // lines_per_sale + 1
+        for offset in range(0, len(sizes), per_batch):
+            sales, carts = [], []
+            for size, date in zip(sizes[offset:offset + per_batch], dates[offset:offset + per_batch]):
+                cart = self.random.choices(ranked, cum_weights=cum_weights, k=size)
+                amounts = self.random.choices(quantities, weights=quantity_weights, k=size)
+                sub_total = sum(price * quantity for (pk, price, buying), quantity in zip(cart, amounts))
+                profit = sum((price - buying) * quantity for (pk, price, buying), quantity in zip(cart, amounts))
+                tax_amount = sub_total * tax_percentage / 100
+                grand_total = sub_total + tax_amount
+                amount_payed = float(int(grand_total) + 1)
+                sales.append(Sale(
+                    date=date,
+                    customer_id=self.random.choice(customer_ids),
+                    sub_total=sub_total, grand_total=grand_total,
+                    tax_amount=tax_amount, tax_percentage=tax_percentage,
+                    amount_payed=amount_payed, amount_change=amount_payed - grand_total,
+                    profit=profit,
+                ))
+                carts.append(list(zip(cart, amounts)))
+                created_lines += size
+
+            with transaction.atomic():
+                Sale.objects.bulk_create(sales)
+                SaleDetail.objects.bulk_create([
+                    SaleDetail(sale_id=sale.id, product_id=pk, price=price, quantity=quantity,
+                               total_detail=price * quantity, buying_price=buying,
+                               profit=(price - buying) * quantity)
+                    for sale, cart in zip(sales, carts)
+                    for (pk, price, buying), quantity in cart
+                ], batch_size=self.batch_size)
+            created_sales += len(sales)
+            self.log("Sales: " + str(created_sales) + ", lines: " + str(created_lines))
+        return created_sales, created_lines
+
+    def generate(self, categories=100, products=100000, customers=50000,
+                 lines=1000000, lines_per_sale=5, days=365):
+        category_ids = self.categories(categories)
+        catalog = self.products(products, category_ids, days)
+        customer_ids = self.customers(customers)
+        sales, lines = self.sales(lines, catalog, customer_ids, days, lines_per_sale)
+        # The bulk inserts skip the model hooks, rebuild the derived tables
+        ProfitRollup.rebuild()
+        summaries.rebuild()
+        return {"categories": len(category_ids), "products": len(catalog),
+                "customers": len(customer_ids), "sales": sales, "lines": lines}
@@ -0,0 +1,95 @@
+import csv
+import json
+from datetime import timedelta
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Value
+from django.db.models.functions import Concat
+from .models import Sale, SaleDetail
+from .summaries import day_start
+
+CHUNK_SIZE = 2000
+
+# Exported columns of each kind, as (header, field)
+EXPORTS = {
+    "sales": (Sale, [
+        ("id", "id"),
+        ("date", "date"),
+        ("customer_id", "customer_id"),
+        ("customer", "customer_name"),
+        ("sub_total", "sub_total"),
+        ("tax_percentage", "tax_percentage"),
+        ("tax_amount", "tax_amount"),
+        ("grand_total", "grand_total"),
+        ("amount_payed", "amount_payed"),
+        ("amount_change", "amount_change"),
+        ("profit", "profit"),
+    ]),
+    "details": (SaleDetail, [
+        ("id", "id"),
+        ("sale_id", "sale_id"),
+        ("date", "sale__date"),
+        ("customer_id", "sale__customer_id"),
+        ("customer", "customer_name"),
+        ("product_id", "product_id"),
+        ("product", "product__name"),
+        ("price", "price"),
+        ("quantity", "quantity"),
+        ("total_detail", "total_detail"),
+        ("buying_price", "buying_price"),
+        ("profit", "profit"),
+    ]),
+}
+
+
+class Echo:
+    """
+    File-like object handing back what csv.writer writes
+    """
+
+    def write(self, value):
+        return value
+
+
+def export_rows(kind, start=None, end=None):
+    """
+    Args:
+        kind: "sales" or "details"
+        start: First day to export, included
+        end: Last day to export, included
+
+    Returns the headers and an iterator over the rows as tuples
+    """
+    model, columns = EXPORTS[kind]
+    prefix = "" if model is Sale else "sale__"
+
+    queryset = model.objects.annotate(customer_name=Concat(
+        prefix + "customer__first_name", Value(" "), prefix + "customer__last_name"))
+    # Bounds on the column itself, a __date lookup can't use its index
+    if start:
+        queryset = queryset.filter(**{prefix + "date__gte": day_start(start)})
+    if end:
+        queryset = queryset.filter(**{prefix + "date__lt": day_start(end + timedelta(days=1))})
+
+    rows = queryset.order_by("id").values_list(
+        *[field for header, field in columns]).iterator(chunk_size=CHUNK_SIZE)
+    return [header for header, field in columns], rows
+
+
+def stream_csv(kind, start=None, end=None):
+    headers, rows = export_rows(kind, start, end)
+    writer = csv.writer(Echo())
+    yield writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_ndjson(kind, start=None, end=None):
+    headers, rows = export_rows(kind, start, end)
+    for row in rows:
+        yield json.dumps(dict(zip(headers, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+FORMATS = {
+    "csv": (stream_csv, "text/csv"),
+    "ndjson": (stream_ndjson, "application/x-ndjson"),
+}
@@ -0,0 +1,244 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Sum
+from django.utils import timezone
+from products.models import Product
+from .models import ProductSalesSummary
+from .summaries import day_start
+
+WINDOWS = ("day", "week", "month")
+METRICS = ("quantity", "revenue", "profit")
+# Products tracked per window and metric, the leaderboard serves up to this many
+CAPACITY = 100
+# Seconds a window is kept once it starts
+WINDOW_TIMEOUTS = {
+    "day": 2 * 86400,
+    "week": 8 * 86400,
+    "month": 32 * 86400,
+}
+# Held while the windows are read and written back, expires on its own
+# if its holder dies
+LOCK_KEY = "leaderboard:lock"
+LOCK_TIMEOUT = 10
+# Seconds the folding thread waits for the lock before dropping the
+# windows instead
+LOCK_WAIT = 2
+
+logger = logging.getLogger(__name__)
+
+# Committed sales waiting to be folded into the windows, as (date, lines)
+_queue = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+class SpaceSaving:
+    """
+    Bounded top-N counter (Metwally et al., Space-Saving). Keeps at most
+    capacity products, a newcomer replaces the smallest counter and
+    inherits its count as the error bound.
+    """
+
+    def __init__(self, capacity=CAPACITY, counters=None):
+        self.capacity = capacity
+        self.counters = counters or {}
+
+    def add(self, item, amount):
+        counters = self.counters
+        if item in counters:
+            counters[item][0] += amount
+        elif len(counters) < self.capacity:
+            counters[item] = [amount, 0]
+        else:
+            smallest = min(counters, key=lambda key: counters[key][0])
+            floor = counters.pop(smallest)[0]
+            counters[item] = [floor + amount, floor]
+
+    def top(self, limit):
+        ranked = sorted(self.counters.items(), key=lambda entry: entry[1][0], reverse=True)
+        return ranked[:limit]
+
+
+def window_start(window, day):
+    if window == "day":
+        return day
+    if window == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def cache_key(window, start, metric):
+    return "leaderboard:" + window + ":" + start.isoformat() + ":" + metric
+
+
+def local_day(value=None):
+    value = value or timezone.now()
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def build(window, metric, start):
+    """
+    Builds a window from the daily sales summaries
+    """
+    totals = ProductSalesSummary.objects.filter(
+        period="DAY", bucket__gte=day_start(start),
+    ).values('product').annotate(total=Sum(metric)).order_by('-total')[:CAPACITY]
+    return SpaceSaving(counters={row['product']: [row['total'], 0] for row in totals})
+
+
+def load(window, metric, start):
+    counters = cache.get(cache_key(window, start, metric))
+    if counters is not None:
+        return SpaceSaving(counters=counters)
+    board = build(window, metric, start)
+    store(window, metric, start, board)
+    return board
+
+
+def store(window, metric, start, board):
+    cache.set(cache_key(window, start, metric), board.counters, WINDOW_TIMEOUTS[window])
+
+
+@contextmanager
+def locked():
+    """
+    Cache lock around a read-modify-write of the windows, cache.add is
+    atomic on the shared backends. Yields False when it wasn't acquired
+    within LOCK_WAIT seconds.
+    """
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + LOCK_WAIT
+    while not cache.add(LOCK_KEY, token, LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            yield False
+            return
+        time.sleep(0.01)
+    try:
+        yield True
+    finally:
+        # Not ours anymore if it expired meanwhile
+        if cache.get(LOCK_KEY) == token:
+            cache.delete(LOCK_KEY)
+
+
+def record(date, lines):
+    """
+    Queues committed sale lines for every window containing the sale and
+    returns at once. A thread per process folds the queued sales into
+    the windows, so the checkouts never wait on the windows' lock.
+    Sales still queued when the process dies are missed until the next
+    roll(), the summaries count them.
+
+    Args:
+        date: The sale's date
+        lines: Iterable of (product ID, quantity, revenue, profit)
+    """
+    _queue.put((date, list(lines)))
+    start_worker()
+
+
+def fold(sales):
+    """
+    Adds the lines of the sales to the windows in one read-modify-write
+    under the lock. A missing window is rebuilt from the summaries,
+    which already count the sales.
+
+    Args:
+        sales: List of (date, lines) as given to record()
+    """
+    windows = {}
+    for date, lines in sales:
+        day = local_day(date)
+        for window in WINDOWS:
+            start = window_start(window, day)
+            for metric in METRICS:
+                key = cache_key(window, start, metric)
+                windows.setdefault(key, (window, metric, start, []))[3].extend(lines)
+
+    with locked() as held:
+        if not held:
+            # Never write back over a concurrent update, the next read
+            # rebuilds the windows from the summaries
+            cache.delete_many(list(windows))
+            return
+
+        found = cache.get_many(list(windows))
+        for key, (window, metric, start, lines) in windows.items():
+            if key not in found:
+                store(window, metric, start, build(window, metric, start))
+                continue
+            board = SpaceSaving(counters=found[key])
+            column = METRICS.index(metric) + 1
+            for line in lines:
+                board.add(line[0], line[column])
+            store(window, metric, start, board)
+
+
+def work():
+    while True:
+        # Everything queued meanwhile is folded at once
+        sales = [_queue.get()]
+        while True:
+            try:
+                sales.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            fold(sales)
+        except Exception:
+            logger.exception("Failed to fold %s sales into the leaderboards", len(sales))
+        finally:
+            connections.close_all()
+            for _ in sales:
+                _queue.task_done()
+
+
+def start_worker():
+    global _worker
+    with _worker_lock:
+        # A forked process doesn't inherit the thread
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=work, name="leaderboard", daemon=True)
+            _worker.start()
+
+
+def flush():
+    """
+    Waits until the queued sales are folded
+    """
+    _queue.join()
+
+
+def roll(day=None):
+    """
+    Rebuilds the current windows from the summaries, run on schedule at
+    the start of the day so new windows start warm and drift is dropped
+    """
+    day = day or local_day()
+    with locked():
+        # Rebuilt from the summaries, written even without the lock
+        for window in WINDOWS:
+            start = window_start(window, day)
+            for metric in METRICS:
+                store(window, metric, start, build(window, metric, start))
+
+
+def leaderboard(window="day", metric="quantity", limit=10):
+    """
+    Returns the top products of the current window as a list of
+    {product: {id, name}, value, error}
+    """
+    start = window_start(window, local_day())
+    board = load(window, metric, start)
+    top = board.top(min(limit, CAPACITY))
+    names = dict(Product.objects.filter(pk__in=[item for item, counts in top]).values_list('pk', 'name'))
+    return [{"product": {"id": item, "name": names.get(item)},
+             "value": count, "error": error}
+            for item, (count, error) in top]
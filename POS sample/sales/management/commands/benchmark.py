@@ -0,0 +1,51 @@
+import json
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from sales.benchmarks import CART_SIZES, CATALOG_SIZES, Benchmark
+
+
+def sizes(value):
+    return tuple(int(size) for size in value.split(","))
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks checkout, the products list, search and receipts on a "
+            "throwaway test database and prints the results as JSON")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--cart-sizes", type=sizes, default=CART_SIZES,
+                            help="Comma separated, 1,10,100 by default")
+        parser.add_argument("--catalog-sizes", type=sizes, default=CATALOG_SIZES,
+                            help="Comma separated, 1000,100000 by default")
+        parser.add_argument("--no-receipts", action="store_true",
+                            help="Skip the receipt PDF scenarios")
+        parser.add_argument("--keepdb", action="store_true",
+                            help="Reuse the benchmark database between runs")
+        parser.add_argument("--output", help="File to write the JSON report to")
+
+    def handle(self, *args, **options):
+        # Never touch the real data, run on the test database
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False, keepdb=options["keepdb"])
+        try:
+            benchmark = Benchmark(iterations=options["iterations"], seed=options["seed"])
+            report = benchmark.run(
+                cart_sizes=options["cart_sizes"],
+                catalog_sizes=options["catalog_sizes"],
+                receipts=not options["no_receipts"],
+            )
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output + "\n")
+        self.stdout.write(output)
@@ -0,0 +1,89 @@
+import zipfile
+from datetime import date, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from weasyprint import HTML
+from sales.models import Sale
+from sales.receipts import (RECEIPT_CACHE_TIMEOUT, get_executor, receipt_cache_key,
+                            receipt_hash, render_receipt_html, write_pdf)
+from sales.summaries import day_start
+
+# Sales rendered per round, bounds the HTML kept in memory
+BATCH_SIZE = 200
+
+
+class Command(BaseCommand):
+    help = "Renders the receipts of a date range into a ZIP of PDFs or one merged PDF"
+
+    def add_arguments(self, parser):
+        parser.add_argument("start", type=date.fromisoformat, help="First day, YYYY-MM-DD")
+        parser.add_argument("end", type=date.fromisoformat, help="Last day, YYYY-MM-DD")
+        parser.add_argument("output", help="Path of the ZIP or PDF file to write")
+        parser.add_argument(
+            "--format", choices=["zip", "pdf"], default="zip",
+            help="zip renders every receipt on its own using all the cores, "
+                 "pdf lays all of them out as a single document")
+        parser.add_argument(
+            "--base-url", default=str(settings.BASE_DIR),
+            help="Base URL used to resolve the receipt's static files")
+
+    def handle(self, *args, **options):
+        if options["start"] > options["end"]:
+            raise CommandError("The start day is after the end day")
+
+        # Bounds on the column itself, a __date lookup can't use its index
+        sales = Sale.objects.filter(
+            date__gte=day_start(options["start"]),
+            date__lt=day_start(options["end"] + timedelta(days=1)),
+        ).with_customer().with_details().order_by('date', 'id')
+
+        if options["format"] == "zip":
+            count = self.export_zip(sales, options["output"], options["base_url"])
+        else:
+            count = self.export_pdf(sales, options["output"], options["base_url"])
+
+        self.stdout.write(self.style.SUCCESS(
+            str(count) + " receipts written to " + options["output"]))
+
+    def batches(self, sales):
+        batch = []
+        for sale in sales.iterator(chunk_size=BATCH_SIZE):
+            batch.append((sale, sale.details))
+            if len(batch) == BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def export_zip(self, sales, output, base_url):
+        executor = get_executor()
+        count = 0
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+            for batch in self.batches(sales):
+                htmls = [render_receipt_html(sale, details) for sale, details in batch]
+                pdfs = executor.map(write_pdf, htmls, [base_url] * len(htmls))
+                for (sale, details), pdf in zip(batch, pdfs):
+                    archive.writestr("receipt_" + str(sale.id) + ".pdf", pdf)
+                    # Warm the cache used by ReceiptPDFView
+                    cache.set(receipt_cache_key(sale, receipt_hash(sale, details)),
+                              pdf, RECEIPT_CACHE_TIMEOUT)
+                    count += 1
+        return count
+
+    def export_pdf(self, sales, output, base_url):
+        first = None
+        pages = []
+        count = 0
+        for batch in self.batches(sales):
+            for sale, details in batch:
+                document = HTML(string=render_receipt_html(sale, details),
+                                base_url=base_url).render()
+                pages.extend(document.pages)
+                count += 1
+                if first is None:
+                    first = document
+        if first is None:
+            raise CommandError("There are no sales in that range")
+        first.copy(pages).write_pdf(output)
+        return count
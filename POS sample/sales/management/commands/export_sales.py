@@ -0,0 +1,25 @@
+import sys
+from datetime import date
+from django.core.management.base import BaseCommand
+from sales.exports import EXPORTS, FORMATS
+
+
+class Command(BaseCommand):
+    help = "Streams the sales or the sale details as CSV or NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(EXPORTS))
+        parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+        parser.add_argument("--start", type=date.fromisoformat, help="First day, YYYY-MM-DD")
+        parser.add_argument("--end", type=date.fromisoformat, help="Last day, YYYY-MM-DD")
+        parser.add_argument("--output", help="File to write, the standard output by default")
+
+    def handle(self, *args, **options):
+        stream, content_type = FORMATS[options["format"]]
+        lines = stream(options["kind"], options["start"], options["end"])
+
+        if options["output"]:
+            with open(options["output"], "w", newline="") as output:
+                output.writelines(lines)
+        else:
+            sys.stdout.writelines(lines)
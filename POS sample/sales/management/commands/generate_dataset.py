@@ -0,0 +1,36 @@
+import json
+from django.core.management.base import BaseCommand
+from sales.dataset import DatasetGenerator
+
+
+class Command(BaseCommand):
+    help = ("Generates a deterministic synthetic dataset of categories, products, "
+            "customers and sales with bulk_create")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--categories", type=int, default=100)
+        parser.add_argument("--products", type=int, default=100000)
+        parser.add_argument("--customers", type=int, default=50000)
+        parser.add_argument("--lines", type=int, default=1000000,
+                            help="Number of sale lines (SaleDetail rows)")
+        parser.add_argument("--lines-per-sale", type=int, default=5)
+        parser.add_argument("--days", type=int, default=365,
+                            help="The sales spread over the last days")
+        parser.add_argument("--zipf", type=float, default=1.1,
+                            help="Exponent of the products' popularity law")
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        generator = DatasetGenerator(
+            seed=options["seed"], batch_size=options["batch_size"], zipf=options["zipf"],
+            log=lambda message: self.stderr.write(message) if options["verbosity"] > 1 else None)
+        totals = generator.generate(
+            categories=options["categories"],
+            products=options["products"],
+            customers=options["customers"],
+            lines=options["lines"],
+            lines_per_sale=options["lines_per_sale"],
+            days=options["days"],
+        )
+        self.stdout.write(self.style.SUCCESS(json.dumps(totals)))
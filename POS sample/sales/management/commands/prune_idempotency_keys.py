@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from sales.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Deletes the checkout idempotency keys older than the given number of days"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7)
+
+    def handle(self, *args, **options):
+        deleted = IdempotencyKey.prune(options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            "Idempotency keys pruned: " + str(deleted)))
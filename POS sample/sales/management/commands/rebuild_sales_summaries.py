@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from sales import summaries
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the hourly and daily sales summaries from the sale details"
+
+    def handle(self, *args, **options):
+        created = summaries.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            "Sales summaries rebuilt: " + str(created) + " rows"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from sales import leaderboard
+
+
+class Command(BaseCommand):
+    help = ("Starts the current day, week and month leaderboards from the sales "
+            "summaries, schedule it right after midnight")
+
+    def handle(self, *args, **options):
+        leaderboard.roll()
+        self.stdout.write(self.style.SUCCESS("Leaderboards rolled"))
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.5 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0009_sale_sale_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CounterShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('value', models.FloatField(default=0)),
+            ],
+            options={
+                'db_table': 'CounterShards',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='countershard',
+            constraint=models.UniqueConstraint(fields=('name', 'shard'), name='unique_counter_shard'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.1.5 on 2026-10-18 13:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0020_catalogchange'),
+        ('sales', '0010_countershard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSalesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('HOUR', 'Hour'), ('DAY', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('revenue', models.FloatField(default=0)),
+                ('profit', models.FloatField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='products.product')),
+            ],
+            options={
+                'db_table': 'ProductSalesSummaries',
+            },
+        ),
+        migrations.CreateModel(
+            name='CategorySalesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('HOUR', 'Hour'), ('DAY', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('revenue', models.FloatField(default=0)),
+                ('profit', models.FloatField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='products.category')),
+            ],
+            options={
+                'db_table': 'CategorySalesSummaries',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='productsalessummary',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket', 'product'), name='unique_product_sales_summary'),
+        ),
+        migrations.AddConstraint(
+            model_name='categorysalessummary',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket', 'category'), name='unique_category_sales_summary'),
+        ),
+    ]
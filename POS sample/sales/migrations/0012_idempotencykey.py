@@ -0,0 +1,27 @@
+# Generated by Django 4.1.5 on 2026-10-18 14:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0011_salessummaries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('date', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('sale', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sales.sale')),
+            ],
+            options={
+                'db_table': 'IdempotencyKeys',
+            },
+        ),
+    ]
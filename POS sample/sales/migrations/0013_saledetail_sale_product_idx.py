@@ -0,0 +1,17 @@
+# Generated by Django 4.1.5 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0012_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='saledetail',
+            index=models.Index(fields=['sale', 'product'], name='saledetail_sale_product_idx'),
+        ),
+    ]
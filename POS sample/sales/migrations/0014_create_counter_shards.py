@@ -0,0 +1,26 @@
+# Generated by Django 4.1.5 on 2026-10-21 09:00
+
+from django.db import migrations
+
+# sales.counters.SHARDS and counter names when this migration was written
+SHARDS = 16
+COUNTERS = ("grand_product_total", "grand_total_amount")
+
+
+def create_shards(apps, schema_editor):
+    CounterShard = apps.get_model('sales', 'CounterShard')
+    CounterShard.objects.bulk_create([
+        CounterShard(name=name, shard=shard)
+        for name in COUNTERS for shard in range(SHARDS)
+    ], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0013_saledetail_sale_product_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_shards, migrations.RunPython.noop),
+    ]
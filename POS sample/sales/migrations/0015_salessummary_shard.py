@@ -0,0 +1,39 @@
+# Generated by Django 4.1.5 on 2026-10-21 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0014_create_counter_shards'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='productsalessummary',
+            name='unique_product_sales_summary',
+        ),
+        migrations.RemoveConstraint(
+            model_name='categorysalessummary',
+            name='unique_category_sales_summary',
+        ),
+        migrations.AddField(
+            model_name='productsalessummary',
+            name='shard',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='categorysalessummary',
+            name='shard',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='productsalessummary',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket', 'product', 'shard'), name='unique_product_sales_summary'),
+        ),
+        migrations.AddConstraint(
+            model_name='categorysalessummary',
+            constraint=models.UniqueConstraint(fields=('period', 'bucket', 'category', 'shard'), name='unique_category_sales_summary'),
+        ),
+    ]
@@ -1,11 +1,48 @@
-from django.db import models
+import threading
+from contextlib import contextmanager
+from django.db import models, transaction
 from django.utils import timezone
-from datetime import datetime
+from datetime import datetime, timedelta
 from customers.models import Customer
-from products.models import Product
+from products.models import Category, Product
 from django.db.models.functions import Coalesce
 from django.db.models import F, FloatField, IntegerField, ExpressionWrapper
 
+# Sales whose totals are recomputed once the block of details is saved
+_deferred_totals = threading.local()
+
+
+class SaleQuerySet(models.QuerySet):
+
+    def with_customer(self):
+        """
+        Loads the customer of every sale in the same query
+        """
+        return self.select_related('customer')
+
+    def with_details(self):
+        """
+        Loads the details of the sales, with their product, in one more
+        query whatever the number of lines. They are kept in sale.details.
+        """
+        return self.prefetch_related(models.Prefetch(
+            'saledetail_set',
+            queryset=SaleDetail.objects.with_product().order_by('id'),
+            to_attr='details',
+        ))
+
+
+class SaleDetailQuerySet(models.QuerySet):
+    # Fields the receipts and the sale pages read
+    FIELDS = ('id', 'sale_id', 'product_id', 'price', 'quantity', 'total_detail',
+              'buying_price', 'profit', 'product__id', 'product__name')
+
+    def with_product(self):
+        """
+        Loads the product's name of every detail in the same query
+        """
+        return self.select_related('product').only(*self.FIELDS)
+
 
 class Sale(models.Model):
     date = models.DateTimeField(default=timezone.now)
@@ -17,10 +54,16 @@ class Sale(models.Model):
     amount_payed = models.FloatField(default=0)
     amount_change = models.FloatField(default=0)
     profit = models.FloatField(default=0)
+
+    objects = SaleQuerySet.as_manager()
  
 
     class Meta:
         db_table = 'Sales'
+        indexes = [
+            # Keyset pagination of the sales list
+            models.Index(fields=['date', 'id'], name='sale_date_id_idx'),
+        ]
 
 
     def __str__(self):
@@ -28,13 +71,60 @@ class Sale(models.Model):
 
 
     def update_totals(self):
-        details = self.saledetail_set.all()
-        self.sub_total = details.aggregate(total=Coalesce(models.Sum(models.F('total_detail')), 0))['total']
+        totals = self.saledetail_set.aggregate(
+            sub_total=Coalesce(models.Sum('total_detail'), 0, output_field=FloatField()),
+            profit=Coalesce(models.Sum('profit'), 0, output_field=FloatField()),
+        )
+        self.sub_total = totals['sub_total']
         self.grand_total = self.sub_total + self.tax_amount
-        self.profit = details.aggregate(total=Coalesce(models.Sum(models.F('profit')), 0))['total']
+        self.profit = totals['profit']
         self.save(update_fields=['sub_total', 'grand_total', 'profit'])
 
 
+    @contextmanager
+    def deferred_totals(self):
+        """
+        Suspends the recompute done by every SaleDetail.save and updates
+        the totals once when the block ends
+        """
+        deferred = getattr(_deferred_totals, 'ids', None)
+        if deferred is None:
+            deferred = _deferred_totals.ids = set()
+        if self.pk in deferred:
+            # Already deferred by an outer block
+            yield self
+            return
+
+        deferred.add(self.pk)
+        try:
+            with transaction.atomic():
+                yield self
+                deferred.discard(self.pk)
+                self.update_totals()
+        finally:
+            deferred.discard(self.pk)
+
+
+    def totals_deferred(self):
+        return self.pk in getattr(_deferred_totals, 'ids', ())
+
+
+    def add_details(self, details):
+        """
+        Args:
+            details: Iterable of dicts with the SaleDetail attributes
+
+        Returns the created details
+        """
+        created = []
+        with self.deferred_totals():
+            for attributes in details:
+                detail = SaleDetail(sale=self, **attributes)
+                detail.save()
+                created.append(detail)
+        return created
+
+
 class SaleDetail(models.Model):
     sale = models.ForeignKey(Sale, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -44,36 +134,141 @@ class SaleDetail(models.Model):
     buying_price = models.FloatField(null=True)  # Nullable field
     profit = models.FloatField(default=0)  # Set default value
 
+    objects = SaleDetailQuerySet.as_manager()
+
 
     class Meta:
         db_table = 'SaleDetails'
+        indexes = [
+            # The lines of a sale, and a product within a sale
+            models.Index(fields=['sale', 'product'], name='saledetail_sale_product_idx'),
+        ]
 
     
     def __str__(self):
-        return "Detail ID: " + str(self.id) + " Sale ID: " + str(self.sale.id) + " Quantity: " + str(self.quantity)
+        return "Detail ID: " + str(self.id) + " Sale ID: " + str(self.sale_id) + " Quantity: " + str(self.quantity)
 
     
     def save(self, *args, **kwargs):
-        print("SaleDetail save method called")
         self.total_detail = self.price * self.quantity
         self.profit = self.total_detail - (self.buying_price * self.quantity) if self.buying_price else 0.0
-        super().save(*args, **kwargs)
-        self.sale.update_totals()
+        # The detail, the stock and the summaries are written together,
+        # the summaries lock one shard of their rows
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if not self.sale.totals_deferred():
+                self.sale.update_totals()
+
+            # Deduct sold quantity from product's stock
+            self.product.deduct_quantity(self.quantity)
+
+            from . import leaderboard, summaries
+            summaries.record(self.sale.date, [(self.product_id, self.product.category_id,
+                                               self.quantity, self.total_detail, self.profit)])
+            line = (self.product_id, self.quantity, self.total_detail, self.profit)
+            transaction.on_commit(lambda: leaderboard.record(self.sale.date, [line]))
+
+
+class CounterShard(models.Model):
+    """
+    One of the rows a global counter is split into, see sales.counters
+    """
+    name = models.CharField(max_length=100)
+    shard = models.PositiveSmallIntegerField()
+    value = models.FloatField(default=0)
+
+
+    class Meta:
+        db_table = 'CounterShards'
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'shard'], name='unique_counter_shard'),
+        ]
+
+
+    def __str__(self):
+        return self.name + " #" + str(self.shard) + ": " + str(self.value)
+
 
-        # Deduct sold quantity from product's quantity
-        product = self.product
-        product.quantity = ExpressionWrapper(F('quantity') - self.quantity, output_field=IntegerField())
-        product.grand_product_total = ExpressionWrapper(F('grand_product_total') - self.total_detail, output_field=FloatField())
-        product.total_amount = ExpressionWrapper(F('total_amount') - self.total_detail, output_field=FloatField())
-        product.save()
+class SalesSummary(models.Model):
+    """
+    Quantity, revenue and profit sold per hour or per day, see sales.summaries.
+    Each bucket is split into SHARDS rows and a sale picks one at random, so
+    concurrent checkouts in the same category rarely wait on each other's row.
+    """
+    PERIOD_CHOICES = (
+        ("HOUR", "Hour"),
+        ("DAY", "Day"),
+    )
+    # Rows each bucket is split into
+    SHARDS = 16
 
-        # Add print statement to verify if product is saved
-        print("Product saved:", product)
+    period = models.CharField(choices=PERIOD_CHOICES, max_length=4)
+    bucket = models.DateTimeField()
+    shard = models.PositiveSmallIntegerField(default=0)
+    quantity = models.BigIntegerField(default=0)
+    revenue = models.FloatField(default=0)
+    profit = models.FloatField(default=0)
+
+
+    class Meta:
+        abstract = True
+
+
+class ProductSalesSummary(SalesSummary):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+
+
+    class Meta:
+        db_table = 'ProductSalesSummaries'
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'bucket', 'product', 'shard'], name='unique_product_sales_summary'),
+        ]
+
+
+    def __str__(self):
+        return self.period + " " + str(self.bucket) + " | Product: " + str(self.product_id)
+
+
+class CategorySalesSummary(SalesSummary):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
 
 
-    #def __init__(self, *args, **kwargs):
-    #    super().__init__(*args, **kwargs)
-    #    self.quantity = self.quantity
+    class Meta:
+        db_table = 'CategorySalesSummaries'
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'bucket', 'category', 'shard'], name='unique_category_sales_summary'),
+        ]
+
+
+    def __str__(self):
+        return self.period + " " + str(self.bucket) + " | Category: " + str(self.category_id)
+
+
+class IdempotencyKey(models.Model):
+    """
+    Key sent by a till with a checkout and the sale it created, a retried
+    checkout with the same key returns that sale, see sales.checkout
+    """
+    key = models.CharField(max_length=100, unique=True)
+    sale = models.ForeignKey(Sale, on_delete=models.CASCADE)
+    date = models.DateTimeField(default=timezone.now, db_index=True)
+
+
+    class Meta:
+        db_table = 'IdempotencyKeys'
+
+
+    def __str__(self):
+        return self.key + " | Sale ID: " + str(self.sale_id)
+
 
-        #product.deduct_quantity(self.quantity)
+    @classmethod
+    def prune(cls, days):
+        """
+        Deletes the keys older than days, a till doesn't retry that late
 
+        Returns the number of keys deleted
+        """
+        deleted, _ = cls.objects.filter(
+            date__lt=timezone.now() - timedelta(days=days)).delete()
+        return deleted
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+from weasyprint import HTML
+
+# Bump when sales_receipt_pdf.html changes so the cached receipts are dropped
+RECEIPT_VERSION = 1
+RECEIPT_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+# Seconds a request waits for a render before answering 202, the worker
+# isn't held for the whole render
+RECEIPT_RENDER_WAIT = 0.2
+
+_executor = None
+_executor_lock = threading.Lock()
+# Renders in flight, so concurrent requests for a receipt share one job
+_pending = {}
+
+
+def receipt_hash(sale, details):
+    """
+    Args:
+        sale: The sale of the receipt
+        details: The sale details, with their products loaded
+
+    Returns a hash of everything printed on the receipt
+    """
+    data = {
+        "version": RECEIPT_VERSION,
+        "sale": [sale.id, str(sale.date), sale.customer_id, sale.sub_total,
+                 sale.grand_total, sale.tax_amount, sale.tax_percentage,
+                 sale.amount_payed, sale.amount_change],
+        "details": [[d.id, d.product_id, d.product.name, d.price, d.quantity,
+                     d.total_detail] for d in details],
+    }
+    raw = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def receipt_cache_key(sale, digest):
+    return "receipt:" + str(sale.id) + ":" + digest
+
+
+def render_receipt_html(sale, details):
+    template = get_template("sales/sales_receipt_pdf.html")
+    return template.render({"sale": sale, "details": details})
+
+
+def write_pdf(html, base_url):
+    """
+    Runs in the worker processes, only takes picklable arguments
+    """
+    return HTML(string=html, base_url=base_url).write_pdf()
+
+
+def get_executor():
+    """
+    Returns the pool of processes rendering the receipts, created on first use
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'RECEIPT_RENDER_WORKERS', None))
+        return _executor
+
+
+def enqueue_receipt(sale, details, base_url, digest=None):
+    """
+    Sends the receipt to the worker processes, the PDF is stored in the
+    cache once rendered.
+
+    Returns a Future with the PDF bytes
+    """
+    digest = digest or receipt_hash(sale, details)
+    key = receipt_cache_key(sale, digest)
+
+    html = render_receipt_html(sale, details)
+    executor = get_executor()
+
+    def store(done):
+        with _executor_lock:
+            _pending.pop(key, None)
+        if not done.cancelled() and done.exception() is None:
+            cache.set(key, done.result(), RECEIPT_CACHE_TIMEOUT)
+
+    with _executor_lock:
+        future = _pending.get(key)
+        if future is not None:
+            return future
+        future = _pending[key] = executor.submit(write_pdf, html, base_url)
+    future.add_done_callback(store)
+    return future
+
+
+def cached_receipt(sale, digest):
+    return cache.get(receipt_cache_key(sale, digest))
+
+
+def render_receipt(sale, details, base_url, digest=None, timeout=None):
+    """
+    Returns the receipt PDF bytes, rendered once per version of the sale.
+    Raises concurrent.futures.TimeoutError when the render takes longer
+    than the timeout, it keeps going in the background.
+    """
+    digest = digest or receipt_hash(sale, details)
+
+    pdf = cached_receipt(sale, digest)
+    if pdf is None:
+        pdf = enqueue_receipt(sale, details, base_url, digest).result(timeout)
+    return pdf
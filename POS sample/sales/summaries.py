@@ -0,0 +1,153 @@
+import random
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth, TruncWeek
+from django.utils import timezone
+from products.upsert import add_to_rows
+from .models import CategorySalesSummary, ProductSalesSummary, SaleDetail, SalesSummary
+
+PERIODS = {
+    "HOUR": TruncHour,
+    "DAY": TruncDay,
+}
+# Reporting buckets, as (summary period read, truncation applied on top)
+BUCKETS = {
+    "hour": ("HOUR", None),
+    "day": ("DAY", None),
+    "week": ("DAY", TruncWeek),
+    "month": ("DAY", TruncMonth),
+}
+GROUPS = {
+    "product": (ProductSalesSummary, "product"),
+    "category": (CategorySalesSummary, "category"),
+    "total": (CategorySalesSummary, None),
+}
+BATCH_SIZE = 5000
+
+
+def bucket_of(value, period):
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    if period == "HOUR":
+        return value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def record(date, lines):
+    """
+    Adds a sale to the hourly and daily summaries, in a fixed number of queries.
+    The sale goes to one random shard of each row, the readers sum the shards.
+    Must be called inside the sale's transaction.
+
+    Args:
+        date: The sale's date
+        lines: Iterable of (product ID, category ID, quantity, revenue, profit)
+    """
+    shard = random.randrange(SalesSummary.SHARDS)
+    products, categories = {}, {}
+    for product_id, category_id, quantity, revenue, profit in lines:
+        for period in PERIODS:
+            bucket = bucket_of(date, period)
+            for rows, key in ((products, (period, bucket, product_id, shard)),
+                              (categories, (period, bucket, category_id, shard))):
+                totals = rows.setdefault(key, {"quantity": 0, "revenue": 0, "profit": 0})
+                totals["quantity"] += quantity
+                totals["revenue"] += revenue
+                totals["profit"] += profit
+
+    add_to_rows(ProductSalesSummary, ('period', 'bucket', 'product_id', 'shard'), products)
+    add_to_rows(CategorySalesSummary, ('period', 'bucket', 'category_id', 'shard'), categories)
+
+
+def rebuild():
+    """
+    Recomputes every summary from the SaleDetail table, on shard 0
+
+    Returns the number of summary rows created
+    """
+    created = 0
+    with transaction.atomic():
+        ProductSalesSummary.objects.all().delete()
+        CategorySalesSummary.objects.all().delete()
+
+        for period, trunc in PERIODS.items():
+            for model, group in ((ProductSalesSummary, 'product'),
+                                 (CategorySalesSummary, 'product__category')):
+                rows = SaleDetail.objects.annotate(
+                    summary_bucket=trunc('sale__date'),
+                ).values('summary_bucket', group).annotate(
+                    total_quantity=Sum('quantity'),
+                    total_revenue=Sum('total_detail'),
+                    total_profit=Sum('profit'),
+                ).order_by()
+
+                key = model._meta.get_field(group.split('__')[-1]).attname
+                batch = []
+                for row in rows.iterator(chunk_size=BATCH_SIZE):
+                    batch.append(model(**{
+                        "period": period,
+                        "bucket": row['summary_bucket'],
+                        key: row[group],
+                        "quantity": row['total_quantity'] or 0,
+                        "revenue": row['total_revenue'] or 0,
+                        "profit": row['total_profit'] or 0,
+                    }))
+                    if len(batch) == BATCH_SIZE:
+                        created += len(model.objects.bulk_create(batch))
+                        batch = []
+                created += len(model.objects.bulk_create(batch))
+    return created
+
+
+def day_start(day):
+    moment = datetime.combine(day, time.min)
+    return timezone.make_aware(moment) if settings.USE_TZ else moment
+
+
+def report(bucket="day", group="total", start=None, end=None, product_id=None, category_id=None):
+    """
+    Args:
+        bucket: hour, day, week or month
+        group: product, category or total
+        start: First day included
+        end: Last day included
+        product_id: Only this product, for the product group
+        category_id: Only this category
+
+    Returns a list of {bucket, [product|category], quantity, revenue, profit}
+    """
+    period, trunc = BUCKETS[bucket]
+    model, key = GROUPS[group]
+
+    summaries = model.objects.filter(period=period)
+    if start:
+        summaries = summaries.filter(bucket__gte=day_start(start))
+    if end:
+        summaries = summaries.filter(bucket__lt=day_start(end + timedelta(days=1)))
+    if product_id and model is ProductSalesSummary:
+        summaries = summaries.filter(product_id=product_id)
+    if category_id:
+        if model is ProductSalesSummary:
+            summaries = summaries.filter(product__category_id=category_id)
+        else:
+            summaries = summaries.filter(category_id=category_id)
+
+    summaries = summaries.annotate(report_bucket=trunc('bucket') if trunc else F('bucket'))
+    fields = ['report_bucket'] + ([key, key + '__name'] if key else [])
+    rows = summaries.values(*fields).annotate(
+        total_quantity=Sum('quantity'),
+        total_revenue=Sum('revenue'),
+        total_profit=Sum('profit'),
+    ).order_by(*fields)
+
+    data = []
+    for row in rows:
+        item = {"bucket": row['report_bucket']}
+        if key:
+            item[key] = {"id": row[key], "name": row[key + '__name']}
+        item.update(quantity=row['total_quantity'], revenue=row['total_revenue'],
+                    profit=row['total_profit'])
+        data.append(item)
+    return data
@@ -1,3 +1,416 @@
-from django.test import TestCase
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import (
+    SimpleTestCase, TestCase, TransactionTestCase, modify_settings, skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date, quote_etag
+from customers.models import Customer
+from products.instrumentation import QueryBudgetMixin, QueryPlanMixin
+from products.models import Product, StockMovement
+from products.pagination import page_query
+from products.testing import build_product, create_category, create_product, create_products
+from . import counters, leaderboard, summaries
+from .checkout import CheckoutError, checkout
+from .models import CategorySalesSummary, IdempotencyKey, Sale, SaleDetail
+from .receipts import receipt_hash
 
-# Create your tests here.
+
+@modify_settings(MIDDLEWARE={'append': 'products.instrumentation.ServerTimingMiddleware'})
+class SalesQueryBudgetTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('cashier', password='secret')
+        cls.customer = Customer.objects.create(first_name="Jane", last_name="Doe")
+        cls.products = create_products(create_category(), 40, quantity=100)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def checkout(self, products, **extra):
+        cart = [{"id": p.id, "price": p.price, "quantity": 2,
+                 "total_product": p.price, "buying_price": p.buying_price}
+                for p in products]
+        return self.client.post(
+            reverse('sales:sales_add'),
+            data=json.dumps({"customer": self.customer.id, "sub_total": 0,
+                             "tax_percentage": 10, "amount_payed": 1000,
+                             "products": cart}),
+            content_type='application/json',
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest', **extra)
+
+    def test_checkout_query_count_does_not_grow_with_the_cart(self):
+        small = self.checkout(self.products[:1])
+        large = self.checkout(self.products)
+        self.assertEqual(Sale.objects.count(), 2)
+        self.assertEqual(small.timings.queries, large.timings.queries)
+        self.assertWithinQueryBudget(large)
+
+    def test_add_page_keeps_the_customers_for_the_template(self):
+        response = self.client.get(reverse('sales:sales_add'))
+        self.assertEqual(response.context["customers"],
+                         [{"label": "Jane Doe", "value": self.customer.id}])
+        self.assertEqual(response.context["customers_url"], reverse('sales:customers_search'))
+
+    def test_sale_details_query_count_does_not_grow_with_the_lines(self):
+        small = checkout(self.customer.id, [
+            {"id": self.products[0].id, "price": 2, "quantity": 1}])
+        large = checkout(self.customer.id, [
+            {"id": p.id, "price": 2, "quantity": 1} for p in self.products])
+        small_response = self.client.get(reverse('sales:sales_details', args=[small.id]))
+        large_response = self.client.get(reverse('sales:sales_details', args=[large.id]))
+        self.assertEqual(len(large_response.context["details"]), len(self.products))
+        self.assertEqual(small_response.timings.queries, large_response.timings.queries)
+        self.assertWithinQueryBudget(large_response)
+
+    def test_retried_checkout_creates_one_sale(self):
+        first = self.checkout(self.products[:2], HTTP_IDEMPOTENCY_KEY="till-1-42")
+        retry = self.checkout(self.products[:2], HTTP_IDEMPOTENCY_KEY="till-1-42")
+        self.assertEqual(Sale.objects.count(), 1)
+        self.assertEqual(IdempotencyKey.objects.get(key="till-1-42").sale, Sale.objects.get())
+        self.assertEqual(self.products[0].on_hand, 98)
+        # The retry doesn't write anything
+        self.assertLess(retry.timings.queries, first.timings.queries)
+
+
+class CheckoutStockTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(first_name="Jane", last_name="Doe")
+        category = create_category()
+        cls.soda = create_product(category, quantity=3)
+        cls.water = create_product(category, "Water", description="Bottle", quantity=1)
+
+    def test_short_cart_lists_every_short_line_and_takes_nothing(self):
+        cart = [{"id": self.soda.id, "price": 2, "quantity": 3},
+                {"id": self.water.id, "price": 2, "quantity": 2}]
+        with self.assertRaises(CheckoutError) as raised:
+            checkout(self.customer.id, cart)
+        self.assertEqual(raised.exception.__cause__.lines, [(self.water.id, 2, 1)])
+        self.assertEqual(Sale.objects.count(), 0)
+        self.assertEqual(StockMovement.on_hand([self.soda.id, self.water.id]),
+                         {self.soda.id: 3, self.water.id: 1})
+
+    def test_counters_add_the_sale_totals(self):
+        cache.clear()
+        cart = [{"id": self.soda.id, "price": 2, "quantity": 2}]
+        checkout(self.customer.id, cart, tax_percentage=10)
+        self.assertEqual(counters.value(counters.GRAND_PRODUCT_TOTAL), -4)
+        self.assertAlmostEqual(counters.value(counters.GRAND_TOTAL_AMOUNT), 4.4)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """
+    Parallel checkouts of overlapping carts in different orders must
+    neither deadlock nor sell more than the stock
+    """
+    THREADS = 8
+    CHECKOUTS = 5
+    STOCK = 10
+
+    def setUp(self):
+        self.customer = Customer.objects.create(first_name="Jane", last_name="Doe")
+        self.products = create_products(create_category(), 4, quantity=self.STOCK)
+
+    def tearDown(self):
+        # The committed sales are folded into the leaderboards in the background
+        leaderboard.flush()
+
+    def test_parallel_checkouts_never_oversell(self):
+        results = []
+        errors = []
+
+        def till(seed):
+            cart = [{"id": p.id, "price": p.price, "quantity": 1} for p in self.products]
+            random.Random(seed).shuffle(cart)
+            try:
+                for _ in range(self.CHECKOUTS):
+                    try:
+                        checkout(self.customer.id, cart)
+                        results.append(True)
+                    except CheckoutError:
+                        results.append(False)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        tills = [threading.Thread(target=till, args=(seed,)) for seed in range(self.THREADS)]
+        for thread in tills:
+            thread.start()
+        for thread in tills:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(results.count(True), self.STOCK)
+        self.assertEqual(Sale.objects.count(), self.STOCK)
+        self.assertEqual(StockMovement.on_hand([p.id for p in self.products]),
+                         {p.id: 0 for p in self.products})
+
+    def test_parallel_duplicates_return_the_first_sale(self):
+        # The whole stock in one cart, a duplicate that waited on the
+        # locks finds nothing left
+        cart = [{"id": p.id, "price": p.price, "quantity": self.STOCK} for p in self.products]
+        sales = []
+        errors = []
+
+        def till():
+            try:
+                sales.append(checkout(self.customer.id, cart, key="till-1:42"))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        tills = [threading.Thread(target=till) for _ in range(self.THREADS)]
+        for thread in tills:
+            thread.start()
+        for thread in tills:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual({sale.id for sale in sales}, {Sale.objects.get().id})
+        self.assertEqual([sale.replayed for sale in sales].count(False), 1)
+
+
+class SalesQueryPlanTests(QueryPlanMixin, TestCase):
+    """
+    The hot queries of sales.views must go through an index
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(first_name="Jane", last_name="Doe")
+        category = create_category()
+        products = Product.objects.bulk_create([
+            build_product(category, "Soda " + str(i), quantity=100) for i in range(50)
+        ])
+        now = timezone.now()
+        sales = Sale.objects.bulk_create([
+            Sale(customer=customer, date=now - timedelta(hours=i))
+            for i in range(500)
+        ])
+        SaleDetail.objects.bulk_create([
+            SaleDetail(sale=sale, product=products[(i + j) % len(products)],
+                       price=2, quantity=1, total_detail=2, buying_price=1, profit=1)
+            for i, sale in enumerate(sales) for j in range(4)
+        ])
+        cls.sale = sales[0]
+        cls.product = products[0]
+
+    def test_sales_list_page(self):
+        self.assertUsesIndexes(page_query(Sale.objects.with_customer()))
+
+    def test_sale_details(self):
+        self.assertUsesIndexes(
+            SaleDetail.objects.with_product().filter(sale_id__in=[self.sale.id]).order_by('id'))
+        self.assertUsesIndexes(SaleDetail.objects.filter(sale=self.sale, product=self.product))
+
+    def test_sales_by_date(self):
+        end = timezone.now()
+        self.assertUsesIndexes(Sale.objects.filter(date__gte=end - timedelta(days=1), date__lt=end))
+
+
+class ReceiptETagTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('cashier', password='secret')
+        customer = Customer.objects.create(first_name="Jane", last_name="Doe")
+        cls.sale = Sale.objects.create(customer=customer)
+        cls.sale.add_details([{"product": create_product(create_category()), "price": 3,
+                               "quantity": 2, "buying_price": 1}])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.url = reverse('sales:sales_receipt_pdf', args=[self.sale.id])
+
+    def etag(self):
+        sale = Sale.objects.with_customer().with_details().get(id=self.sale.id)
+        return quote_etag(receipt_hash(sale, sale.details))
+
+    @mock.patch('sales.views.render_receipt')
+    def test_unchanged_receipt_is_not_modified(self, render_receipt):
+        etag = self.etag()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=http_date(self.sale.date.timestamp() + 60))
+        self.assertEqual(response.status_code, 304)
+        render_receipt.assert_not_called()
+
+    @mock.patch('sales.views.render_receipt', return_value=b"%PDF")
+    def test_changed_receipt_is_sent_again(self, render_receipt):
+        etag = self.etag()
+        SaleDetail.objects.filter(sale=self.sale).update(price=4)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response['ETag'], self.etag())
+        self.assertEqual(response.content, b"%PDF")
+
+
+class LeaderboardRecordTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.day = leaderboard.local_day()
+        for window in leaderboard.WINDOWS:
+            for metric in leaderboard.METRICS:
+                leaderboard.store(window, metric, leaderboard.window_start(window, self.day),
+                                  leaderboard.SpaceSaving())
+
+    def counts(self, window="day", metric="quantity"):
+        return leaderboard.load(window, metric, leaderboard.window_start(window, self.day)).counters
+
+    def test_parallel_records_lose_nothing(self):
+        now = timezone.now()
+        tills = [threading.Thread(target=leaderboard.record, args=(now, [(7, 1, 2.0, 1.0)]))
+                 for _ in range(8)]
+        for thread in tills:
+            thread.start()
+        for thread in tills:
+            thread.join()
+        leaderboard.flush()
+        self.assertEqual(self.counts(), {7: [8, 0]})
+        self.assertEqual(self.counts("month", "revenue"), {7: [16.0, 0]})
+
+    def test_record_does_not_wait_on_the_lock(self):
+        cache.add(leaderboard.LOCK_KEY, "other", leaderboard.LOCK_TIMEOUT)
+        started = time.monotonic()
+        leaderboard.record(timezone.now(), [(7, 1, 2.0, 1.0)])
+        self.assertLess(time.monotonic() - started, 0.1)
+        cache.delete(leaderboard.LOCK_KEY)
+        leaderboard.flush()
+        self.assertEqual(self.counts(), {7: [1, 0]})
+
+    def test_drops_the_windows_when_locked_out(self):
+        cache.add(leaderboard.LOCK_KEY, "other", leaderboard.LOCK_TIMEOUT)
+        with mock.patch.object(leaderboard, "LOCK_WAIT", 0):
+            leaderboard.fold([(timezone.now(), [(7, 1, 2.0, 1.0)])])
+        key = leaderboard.cache_key("day", self.day, "quantity")
+        self.assertIsNone(cache.get(key))
+
+
+class SaleTotalsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(first_name="Jane", last_name="Doe")
+        cls.products = create_products(create_category(), 5, quantity=100)
+
+    def details(self):
+        return [{"product": product, "price": 3, "quantity": 2, "buying_price": 1}
+                for product in self.products]
+
+    def sale_updates(self, queries):
+        prefix = "UPDATE " + connection.ops.quote_name(Sale._meta.db_table)
+        return [query for query in queries if query['sql'].startswith(prefix)]
+
+    def test_add_details_updates_the_totals_once(self):
+        sale = Sale.objects.create(customer=self.customer, tax_amount=1)
+        with CaptureQueriesContext(connection) as queries:
+            sale.add_details(self.details())
+        self.assertEqual(len(self.sale_updates(queries.captured_queries)), 1)
+        sale.refresh_from_db()
+        self.assertEqual((sale.sub_total, sale.grand_total, sale.profit), (30, 31, 20))
+
+    def test_nested_blocks_update_once(self):
+        sale = Sale.objects.create(customer=self.customer)
+        with CaptureQueriesContext(connection) as queries:
+            with sale.deferred_totals():
+                sale.add_details(self.details()[:2])
+                sale.add_details(self.details()[2:])
+        self.assertEqual(len(self.sale_updates(queries.captured_queries)), 1)
+        self.assertEqual(Sale.objects.get(pk=sale.pk).sub_total, 30)
+
+    def test_single_save_still_updates_the_totals(self):
+        sale = Sale.objects.create(customer=self.customer)
+        SaleDetail(sale=sale, **self.details()[0]).save()
+        self.assertEqual(Sale.objects.get(pk=sale.pk).sub_total, 6)
+
+
+class SalesSummaryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(first_name="Jane", last_name="Doe")
+        cls.drinks = create_category()
+        cls.snacks = create_category("Snacks", "Chips")
+        cls.soda = create_product(cls.drinks, quantity=100)
+        cls.chips = create_product(cls.snacks, "Chips", quantity=100)
+
+    def sell(self, when, *products):
+        sale = Sale.objects.create(customer=self.customer, date=self.moment(*when))
+        sale.add_details([{"product": product, "price": 3, "quantity": 2, "buying_price": 1}
+                          for product in products])
+
+    def moment(self, *args):
+        return timezone.make_aware(datetime(*args))
+
+    def totals(self, rows):
+        return [(row["bucket"], row["quantity"], row["revenue"], row["profit"]) for row in rows]
+
+    def sell_the_month(self):
+        # The writes go round the shards
+        turns = itertools.count()
+        with mock.patch('sales.summaries.random.randrange', lambda shards: next(turns) % shards):
+            self.sell((2026, 10, 5, 10, 15), self.soda, self.chips)
+            self.sell((2026, 10, 5, 10, 40), self.soda)
+            self.sell((2026, 10, 5, 14, 0), self.chips)
+            self.sell((2026, 10, 7, 9, 0), self.soda)
+            self.sell((2026, 11, 2, 12, 0), self.soda)
+
+    def test_buckets_sum_the_shards(self):
+        self.sell_the_month()
+        self.assertEqual(self.totals(summaries.report("hour", end=date(2026, 10, 5))), [
+            (self.moment(2026, 10, 5, 10), 6, 18, 12),
+            (self.moment(2026, 10, 5, 14), 2, 6, 4),
+        ])
+        self.assertEqual(self.totals(summaries.report("day")), [
+            (self.moment(2026, 10, 5), 8, 24, 16),
+            (self.moment(2026, 10, 7), 2, 6, 4),
+            (self.moment(2026, 11, 2), 2, 6, 4),
+        ])
+        self.assertEqual(self.totals(summaries.report("week")), [
+            (self.moment(2026, 10, 5), 10, 30, 20),
+            (self.moment(2026, 11, 2), 2, 6, 4),
+        ])
+        self.assertEqual(self.totals(summaries.report("month")), [
+            (self.moment(2026, 10, 1), 10, 30, 20),
+            (self.moment(2026, 11, 1), 2, 6, 4),
+        ])
+
+    def test_groups_and_filters(self):
+        self.sell_the_month()
+        rows = summaries.report("month", "category", start=date(2026, 10, 1), end=date(2026, 10, 31))
+        self.assertEqual([(row["category"]["name"], row["quantity"]) for row in rows],
+                         [("Drinks", 6), ("Snacks", 4)])
+        rows = summaries.report("day", "product", category_id=self.snacks.id)
+        self.assertEqual([(row["product"]["id"], row["bucket"], row["quantity"]) for row in rows],
+                         [(self.chips.id, self.moment(2026, 10, 5), 4)])
+
+    def test_rebuild_matches_the_incremental_totals(self):
+        self.sell_the_month()
+        reports = [(bucket, group) for bucket in summaries.BUCKETS for group in summaries.GROUPS]
+        incremental = [summaries.report(bucket, group) for bucket, group in reports]
+        self.assertGreater(CategorySalesSummary.objects.values('shard').distinct().count(), 1)
+
+        summaries.rebuild()
+        self.assertEqual([summaries.report(bucket, group) for bucket, group in reports], incremental)
+        self.assertEqual(CategorySalesSummary.objects.exclude(shard=0).count(), 0)
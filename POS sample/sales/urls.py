@@ -6,11 +6,24 @@ app_name = "sales"
 urlpatterns = [
     # List sales
     path('', views.SalesListView, name='sales_list'),
+    # Load more sales (JSON)
+    path('more', views.SalesMoreView, name='sales_more'),
+    # Export sales or sale details (CSV / NDJSON)
+    path('export/<str:kind>', views.SalesExportView, name='sales_export'),
+    # Sales reports (JSON)
+    path('reports', views.SalesReportView, name='sales_reports'),
+    # Top sellers of the day, week or month (JSON)
+    path('leaderboard', views.LeaderboardView, name='sales_leaderboard'),
+    # Search customers (select2)
+    path('customers', views.CustomersSearchView, name='customers_search'),
     # Add sale
     path('add', views.SalesAddView, name='sales_add'),
     # Details sale
     path('details/<str:sale_id>',
          views.SalesDetailsView, name='sales_details'),
+    # Details sale, async variant for ASGI
+    path('async/details/<str:sale_id>',
+         views.SalesDetailsAsyncView, name='sales_details_async'),
     # Sale receipt PDF
     path("pdf/<str:sale_id>",
          views.ReceiptPDFView, name="sales_receipt_pdf"),
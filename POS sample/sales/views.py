@@ -1,23 +1,27 @@
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse, Http404
 from django.shortcuts import render, redirect
+from django.urls import reverse
 from django_pos.wsgi import *
 from django_pos import settings
-from django.template.loader import get_template
-from customers.models import Customer
-from products.models import Product
-from weasyprint import HTML, CSS
-from .models import Sale, SaleDetail
-from django.db import transaction
+from products.pagination import paginate_request
+from products.instrumentation import span
+from products.decorators import async_login_required
+from asgiref.sync import sync_to_async
+from .models import Sale
+from .checkout import checkout, CheckoutError
+from .receipts import RECEIPT_RENDER_WAIT, receipt_hash, render_receipt
+from .exports import EXPORTS, FORMATS
+from .customers import search_customers
+from .summaries import BUCKETS, GROUPS, report
+from .leaderboard import METRICS, WINDOWS, leaderboard
+from . import counters
+from datetime import date
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 import json
-from reportlab.pdfgen import canvas
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, Image
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.pagesizes import letter
-import os
-from django.db.models import F, IntegerField, FloatField
-from django.db.models.functions import Cast
+from concurrent.futures import TimeoutError
 
 
 def is_ajax(request):
@@ -26,21 +30,128 @@ def is_ajax(request):
 
 @login_required(login_url="/accounts/login/")
 def SalesListView(request):
+    # Only one page of sales is loaded
+    sales = paginate_request(request, Sale.objects.with_customer())
     context = {
         "active_icon": "sales",
-        "sales": Sale.objects.all().order_by('-date')
+        "sales": sales,
+        "next_cursor": sales.next_cursor,
+        "previous_cursor": sales.previous_cursor,
+        # Store-wide totals since the counters started, cached a few seconds
+        "grand_total_amount": counters.value(counters.GRAND_TOTAL_AMOUNT),
+        "grand_product_total": counters.value(counters.GRAND_PRODUCT_TOTAL),
     }
     return render(request, "sales/sales.html", context=context)
 
 
+@login_required(login_url="/accounts/login/")
+def SalesMoreView(request):
+    """
+    Returns the next page of sales for the "load more" button
+    """
+    sales = paginate_request(request, Sale.objects.with_customer())
+    data = [{
+        "id": sale.id,
+        "date": sale.date,
+        "customer": str(sale.customer),
+        "sub_total": sale.sub_total,
+        "tax_amount": sale.tax_amount,
+        "grand_total": sale.grand_total,
+        "amount_payed": sale.amount_payed,
+        "amount_change": sale.amount_change,
+    } for sale in sales]
+    return JsonResponse({
+        "sales": data,
+        "next_cursor": sales.next_cursor,
+        "previous_cursor": sales.previous_cursor,
+    })
+
+
 
 @login_required(login_url="/accounts/login/")
-def SalesAddView(request):
-    context = {
-        "active_icon": "sales",
-        "customers": [c.to_select2() for c in Customer.objects.all()]
-    }
+def SalesExportView(request, kind):
+    """
+    Args:
+        kind: "sales" or "details"
+
+    GET arguments: format (csv or ndjson), start and end days (YYYY-MM-DD)
+    """
+    export_format = request.GET.get('format', 'csv')
+    if kind not in EXPORTS or export_format not in FORMATS:
+        raise Http404("Unknown export")
+
+    try:
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+    except ValueError:
+        return HttpResponse("Invalid date, use YYYY-MM-DD", status=400)
+
+    stream, content_type = FORMATS[export_format]
+    response = StreamingHttpResponse(stream(kind, start, end), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="' + kind + '.' + export_format + '"'
+    return response
+
+
+@login_required(login_url="/accounts/login/")
+def CustomersSearchView(request):
+    """
+    Paginated customer search for the select2 widget,
+    GET arguments: term and page
+    """
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+    return JsonResponse(search_customers(request.GET.get('term', ''), page))
+
+
+@login_required(login_url="/accounts/login/")
+def SalesReportView(request):
+    """
+    GET arguments: bucket (hour, day, week or month), by (product,
+    category or total), start and end days (YYYY-MM-DD), product, category
+    """
+    bucket = request.GET.get('bucket', 'day')
+    group = request.GET.get('by', 'total')
+    if bucket not in BUCKETS or group not in GROUPS:
+        return JsonResponse({"error": "Unknown bucket or grouping"}, status=400)
+
+    try:
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+        product_id = int(request.GET['product']) if request.GET.get('product') else None
+        category_id = int(request.GET['category']) if request.GET.get('category') else None
+    except ValueError:
+        return JsonResponse({"error": "Invalid date or ID"}, status=400)
+
+    data = report(bucket, group, start, end, product_id, category_id)
+    return JsonResponse({"bucket": bucket, "by": group, "results": data})
+
+
+@login_required(login_url="/accounts/login/")
+def LeaderboardView(request):
+    """
+    GET arguments: window (day, week or month), metric (quantity,
+    revenue or profit) and limit
+    """
+    window = request.GET.get('window', 'day')
+    metric = request.GET.get('metric', 'quantity')
+    if window not in WINDOWS or metric not in METRICS:
+        return JsonResponse({"error": "Unknown window or metric"}, status=400)
+    try:
+        limit = max(1, int(request.GET.get('limit', 10)))
+    except ValueError:
+        limit = 10
+
+    return JsonResponse({
+        "window": window,
+        "metric": metric,
+        "results": leaderboard(window, metric, limit),
+    })
 
+
+@login_required(login_url="/accounts/login/")
+def SalesAddView(request):
     if request.method == 'POST':
         if is_ajax(request=request):
             # Save the POST arguements
@@ -48,96 +159,38 @@ def SalesAddView(request):
 
             # Extract values from the data
             customer_id = int(data['customer'])
-            sub_total = float(data["sub_total"])
             tax_percentage = float(data["tax_percentage"])
             amount_payed = float(data["amount_payed"])
+            products = data["products"]
+            # Sent again by the till when it retries the same checkout
+            key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
 
-            # Calculate tax amount
-            tax_amount = sub_total * (tax_percentage / 100)
-
-            # Calculate grand total including tax
-            grand_total = sub_total + tax_amount
-
-            # Calculate the change amount
-            amount_change = amount_payed - grand_total
-
-            sale_attributes = {
-                "customer": Customer.objects.get(id=int(data['customer'])),
-                "sub_total": sub_total,
-                "grand_total": grand_total,
-                "tax_amount": tax_amount,
-                "tax_percentage": tax_percentage,
-                "amount_payed": amount_payed,
-                "amount_change": amount_change,
-            }
-            
             try:
-                # Create the sale
-                new_sale = Sale.objects.create(**sale_attributes)                                                  
-                # Create the sale details
-                products = data["products"]
-              
-                for product in products:
-                    detail_attributes = {
-                        "sale": new_sale,
-                        #"sale": Sale.objects.get(id=new_sale.id),
-                        "product": Product.objects.get(id=int(product["id"])),
-                        "price": float(product["price"]),
-                        "quantity": int(product["quantity"]),
-                        "total_detail": float(product["total_product"]) * int(product["quantity"]),
-                        "buying_price": float(product["buying_price"]),  # Add buying_price field
-                    }
-
-                    try:
-                        sale_detail_new = SaleDetail.objects.create(**detail_attributes)
-                        sale_detail_new.save()
-
-                        # Update the product quantity and total amount
-                        product_obj = Product.objects.get(id=int(product["id"]))
-                        quantity_to_deduct = int(product["quantity"])
-                        product_obj.quantity -= quantity_to_deduct
-                        #product_obj.quantity = F('quantity', output_field=IntegerField()) - Cast(int(product["quantity"]), output_field=IntegerField())                                   
-                        product_obj.total_amount -= (float(product["total_product"]) * quantity_to_deduct)                  
-                        product_obj.save()
-
-                        # Add print statements to track the changes
-                        print("Product quantity:", product_obj.quantity)
-                        print("Product total amount:", product_obj.total_amount)
-
-                    except Exception as e:
-                        messages.error(request, 'There was an error creating the sale detail!',
-                                       extra_tags="danger")
-                        print("Error creating sale detail:", str(e))
-                        
-                # Update the grand product total
-                grand_product_total = sum([float(p["total_product"]) for p in products])
-                product_application = Application.objects.get(name="product")
-                product_application.grand_product_total -= grand_product_total
-                product_application.save()
-
-                # Add print statements to track the changes
-                print("Grand product total:", product_application.grand_product_total)
-
-                # Update the grand total amount
-                grand_total_amount = grand_total
-                sales_application = Application.objects.get(name="sales")
-                sales_application.grand_total_amount += grand_total_amount
-                sales_application.save()
-
-                # Add print statements to track the changes
-                print("Grand total amount:", sales_application.grand_total_amount)
-
-                # Call update totals method on the sale instance
-                new_sale.update_totals()
-                        
-                messages.success(
-                    request, 'Sale created succesfully!', extra_tags="success")
-            
+                # Create the sale and its details in one transaction
+                new_sale = checkout(
+                    customer_id, products, tax_percentage, amount_payed, key)
+                if new_sale.replayed:
+                    messages.info(
+                        request, 'Sale already created!', extra_tags="info")
+                else:
+                    messages.success(
+                        request, 'Sale created succesfully!', extra_tags="success")
+
+            except CheckoutError as e:
+                messages.error(request, str(e), extra_tags="danger")
             except Exception as e:
                 messages.error(request, 'There was an error during the creation!', extra_tags="danger")
                 #print("Error creating sale: ", str(e))
         return redirect('sales:sales_list')
 
+    # The customers are searched through CustomersSearchView. Until
+    # sales_add.html queries it, "customers" keeps the first page of
+    # them in the to_select2 shape the template reads.
+    context = {
+        "active_icon": "sales",
+        "customers": search_customers("")["results"],
+        "customers_url": reverse('sales:customers_search'),
+    }
     return render(request, "sales/sales_add.html", context=context)
 
 
@@ -149,16 +202,13 @@ def SalesDetailsView(request, sale_id):
         sale_id: ID of the sale to view
     """
     try:
-        # Get tthe sale
-        sale = Sale.objects.get(id=sale_id)
-
-        # Get the sale details
-        details = SaleDetail.objects.filter(sale=sale)
+        # Get the sale with its customer and details, in two queries
+        sale = Sale.objects.with_customer().with_details().get(id=sale_id)
 
         context = {
             "active_icon": "sales",
             "sale": sale,
-            "details": details,
+            "details": sale.details,
         }
         return render(request, "sales/sales_details.html", context=context)
     except Exception as e:
@@ -168,57 +218,63 @@ def SalesDetailsView(request, sale_id):
         return redirect('sales:sales_list')
 
 
-@login_required(login_url="/accounts/login/")
-def ReceiptPDFView(request, sale_id):
+@async_login_required(login_url="/accounts/login/")
+async def SalesDetailsAsyncView(request, sale_id):
     """
+    SalesDetailsView for ASGI
+
     Args:
-        sale_id: ID of the sale to view the receipt
+        sale_id: ID of the sale to view
     """
-    # Get tthe sale
-    sale = Sale.objects.get(id=sale_id)
-
-    # Get the sale details
-    details = SaleDetail.objects.filter(sale=sale)
+    try:
+        sale = await Sale.objects.with_customer().with_details().aget(id=sale_id)
+    except (Sale.DoesNotExist, ValueError):
+        await sync_to_async(messages.success)(
+            request, 'There was an error getting the sale!', extra_tags="danger")
+        return redirect('sales:sales_list')
 
-    template = get_template("sales/sales_receipt_pdf.html")
     context = {
+        "active_icon": "sales",
         "sale": sale,
-        "details": details
+        "details": sale.details,
     }
-    html_template = template.render(context)
-
-    # CSS Boostrap
-    css_url = os.path.join(
-        settings.BASE_DIR, 'static/css/receipt_pdf/bootstrap.min.css')
-
-    # Create the pdf
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename="receipt.pdf"'
-
-    doc = SimpleDocTemplate(response, pagesize=letter)
-    html_template = template.render(context, request=request)
-    story = []
-
-    # Add the header
-    styles = getSampleStyleSheet()
-    header = Paragraph("<font size='16'>Receipt</font>", style=styles['Title'])
-    story.append(header)
-
-    # Add the table of sale details
-    table_data = [("Product", "Quantity", "Price")]
-
-    for detail in details:
-        table_data.append((detail.product.name, detail.quantity, detail.price))
+    return await sync_to_async(render)(request, "sales/sales_details.html", context=context)
 
-    table = Table(table_data)
-    story.append(table)
 
-    # Add the footer
-    footer = Paragraph("<font size='12'>Thank you for your purchase!</font>", style=styles['Normal'])
-    story.append(footer)
-
-    pdf = HTML(string=html_template, base_url=request.build_absolute_uri()).write_pdf()
+@login_required(login_url="/accounts/login/")
+def ReceiptPDFView(request, sale_id):
+    """
+    Args:
+        sale_id: ID of the sale to view the receipt
+    """
+    # Get the sale with its customer and details, in two queries
+    sale = Sale.objects.with_customer().with_details().get(id=sale_id)
+    details = sale.details
+
+    # A completed sale never changes, let the browser reuse its copy
+    digest = receipt_hash(sale, details)
+    etag = quote_etag(digest)
+    last_modified = int(sale.date.timestamp())
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        return not_modified
+
+    # Create the pdf in the render workers, served from the cache on reprints
+    try:
+        with span('pdf'):
+            pdf = render_receipt(
+                sale, details, base_url=request.build_absolute_uri(), digest=digest,
+                timeout=getattr(settings, 'RECEIPT_RENDER_WAIT', RECEIPT_RENDER_WAIT))
+    except TimeoutError:
+        # Still rendering, the till retries shortly
+        response = HttpResponse(status=202)
+        response['Retry-After'] = 1
+        return response
     response = HttpResponse(pdf, content_type='application/pdf')
     response['Content-Disposition'] = 'filename="receipt.pdf"'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
 
     return response